@@ -0,0 +1,230 @@
+"""
+Speech recognition backends for the voice pipeline.
+
+Every backend has the same async contract: an utterance prepared once with
+prepare() (16-bit mono PCM plus whatever encoding the backend needs) in, an
+n-best list of lower-cased transcripts out (best first, empty if nothing
+was heard). The prepared audio is reused for every language.
+Backends with supports_streaming can also recognize an utterance
+incrementally through open_stream() while the user is still speaking.
+Chọn backend bằng biến môi trường ASR_BACKEND trong file .env:
+    ASR_BACKEND=google   # Google Web Speech (mặc định, cần internet)
+    ASR_BACKEND=vosk     # Vosk offline trên CPU, cần tải model
+"""
+
+import json
+import os
+import speech_recognition as sr
+from dotenv import load_dotenv
+from asr_pool import get_asr_pool
+from asr_client import get_speech_client
+from dsp_pool import get_dsp_pool
+
+load_dotenv()
+
+# Try to import vosk for offline recognition
+try:
+    import vosk
+    vosk.SetLogLevel(-1)
+    VOSK_AVAILABLE = True
+except ImportError:
+    vosk = None
+    VOSK_AVAILABLE = False
+
+# ============================================
+# CONFIGURATION
+# ============================================
+ASR_BACKEND = os.getenv('ASR_BACKEND', 'google').lower()
+ASR_MAX_ALTERNATIVES = 3  # Số kết quả n-best trả về
+
+# Đường dẫn model Vosk theo ngôn ngữ (tải tại https://alphacephei.com/vosk/models)
+VOSK_MODEL_PATHS = {
+    'vi-VN': os.getenv('VOSK_MODEL_VI'),
+    'en-US': os.getenv('VOSK_MODEL_EN'),
+}
+
+
+_vosk_models = {}  # path -> vosk.Model
+
+def load_vosk_model(path):
+    """Load a Vosk model once per process and reuse it everywhere."""
+    if path not in _vosk_models:
+        print(f"[ASR] Loading Vosk model: {path}")
+        _vosk_models[path] = vosk.Model(path)
+    return _vosk_models[path]
+
+
+def _vosk_texts(result):
+    """Transcripts from a Vosk result, with or without SetMaxAlternatives."""
+    if 'alternatives' in result:
+        texts = [alt.get('text', '') for alt in result['alternatives']]
+    else:
+        texts = [result.get('text', '')]
+    return [t.strip().lower() for t in texts if t.strip()]
+
+
+class RecognitionStream:
+    """Incremental recognizer for one utterance.
+
+    Methods are blocking and meant to run on ASR pool threads, one call at a
+    time per stream.
+    """
+
+    def feed(self, pcm):
+        """Feed more PCM. Returns the current partial transcript."""
+        raise NotImplementedError
+
+    def finish(self):
+        """End the utterance. Returns the n-best transcripts, best first."""
+        raise NotImplementedError
+
+
+class VoskRecognitionStream(RecognitionStream):
+    def __init__(self, model, sample_rate):
+        self.recognizer = vosk.KaldiRecognizer(model, sample_rate)
+        self.recognizer.SetMaxAlternatives(ASR_MAX_ALTERNATIVES)
+        self.segments = []  # Đoạn Vosk đã tự chốt giữa câu
+
+    def feed(self, pcm):
+        if self.recognizer.AcceptWaveform(pcm):
+            texts = _vosk_texts(json.loads(self.recognizer.Result()))
+            if texts:
+                self.segments.append(texts[0])
+            partial = ''
+        else:
+            partial = json.loads(self.recognizer.PartialResult()).get('partial', '')
+        return ' '.join(self.segments + [partial]).strip().lower()
+
+    def finish(self):
+        texts = _vosk_texts(json.loads(self.recognizer.FinalResult()))
+        prefix = ' '.join(self.segments)
+        if not texts:
+            return [prefix] if prefix else []
+        return [f"{prefix} {t}".strip() for t in texts]
+
+
+class ASRBackend:
+    """Base class: PCM in, n-best transcripts out."""
+
+    name = "base"
+    supports_streaming = False
+
+    def supports(self, language):
+        """Whether this backend can recognize the given language."""
+        return True
+
+    async def prepare(self, pcm, sample_rate, guild_id=None):
+        """Wrap an utterance's 16-bit mono PCM for recognize(), encoding it if needed.
+
+        Called once per utterance; the result is shared by all languages.
+        """
+        return sr.AudioData(pcm, sample_rate, 2)
+
+    async def recognize(self, audio, language, guild_id=None):
+        """Recognize audio from prepare(). Returns a list of transcripts, best first.
+
+        guild_id picks the fair-share queue in the ASR worker pool.
+        """
+        raise NotImplementedError
+
+    def open_stream(self, language, sample_rate):
+        """Start an incremental recognition (only if supports_streaming)."""
+        raise NotImplementedError
+
+
+class PreEncodedAudioData(sr.AudioData):
+    """AudioData whose FLAC encoding was done once up front (prepare)."""
+
+    def __init__(self, pcm, sample_rate, flac_data):
+        super().__init__(pcm, sample_rate, 2)
+        self.flac_data = flac_data
+
+    def get_flac_data(self, convert_rate=None, convert_width=None):
+        if convert_rate in (None, self.sample_rate) and convert_width in (None, 2):
+            return self.flac_data
+        return super().get_flac_data(convert_rate, convert_width)
+
+
+class GoogleASRBackend(ASRBackend):
+    """Google Web Speech API over the keep-alive async client (one request per call)."""
+
+    name = "google"
+
+    async def prepare(self, pcm, sample_rate, guild_id=None):
+        # Encode FLAC 1 lần (16kHz) cho cả vi và en; ở process DSP nếu có bật
+        flac_data = await get_asr_pool().run(
+            guild_id,
+            lambda: get_dsp_pool().encode_flac(pcm, sample_rate)
+        )
+        return PreEncodedAudioData(pcm, sample_rate, flac_data)
+
+    async def recognize(self, audio, language, guild_id=None):
+        # Request chạy trên event loop, không giữ thread nào khi chờ mạng
+        client = get_speech_client()
+        flac_data = audio.get_flac_data()
+        texts = await get_asr_pool().run_async(
+            guild_id,
+            lambda: client.recognize(flac_data, audio.sample_rate, language)
+        )
+        return texts[:ASR_MAX_ALTERNATIVES]
+
+
+class VoskASRBackend(ASRBackend):
+    """Offline Vosk recognizer. Models are loaded once and kept warm."""
+
+    name = "vosk"
+    supports_streaming = True
+
+    def __init__(self, model_paths=None):
+        if not VOSK_AVAILABLE:
+            raise RuntimeError("vosk not installed - run: pip install vosk")
+        self.models = {}
+        for language, path in (model_paths or VOSK_MODEL_PATHS).items():
+            if path:
+                self.models[language] = load_vosk_model(path)
+        if not self.models:
+            raise RuntimeError("No Vosk model configured - set VOSK_MODEL_VI and/or VOSK_MODEL_EN in .env")
+
+    def supports(self, language):
+        return language in self.models
+
+    def _recognize_sync(self, audio, language):
+        recognizer = vosk.KaldiRecognizer(self.models[language], audio.sample_rate)
+        recognizer.SetMaxAlternatives(ASR_MAX_ALTERNATIVES)
+        recognizer.AcceptWaveform(audio.frame_data)
+        return _vosk_texts(json.loads(recognizer.FinalResult()))
+
+    async def recognize(self, audio, language, guild_id=None):
+        if not self.supports(language):
+            return []
+        return await get_asr_pool().run(
+            guild_id,
+            lambda: self._recognize_sync(audio, language)
+        )
+
+    def open_stream(self, language, sample_rate):
+        return VoskRecognitionStream(self.models[language], sample_rate)
+
+
+ASR_BACKENDS = {
+    'google': GoogleASRBackend,
+    'vosk': VoskASRBackend,
+}
+
+_asr_backend = None
+
+def get_asr_backend():
+    """Get the process-wide ASR backend selected by ASR_BACKEND (created once)."""
+    global _asr_backend
+    if _asr_backend is None:
+        backend_cls = ASR_BACKENDS.get(ASR_BACKEND)
+        if backend_cls is None:
+            print(f"⚠️ Unknown ASR_BACKEND '{ASR_BACKEND}', using google")
+            backend_cls = GoogleASRBackend
+        try:
+            _asr_backend = backend_cls()
+        except Exception as e:
+            print(f"⚠️ ASR backend '{backend_cls.name}' unavailable ({e}), using google")
+            _asr_backend = GoogleASRBackend()
+        print(f"✅ ASR backend: {_asr_backend.name}")
+    return _asr_backend
@@ -0,0 +1,204 @@
+"""
+Async HTTP client for the Google Web Speech API.
+
+speech_recognition opens a new urllib connection (and TLS handshake) for
+every request and blocks a worker thread while it waits. This client sends
+the same request from the event loop through one aiohttp session, so
+connections stay open between utterances and a pending request costs no
+thread. Every request has a timeout, and failed requests are retried only
+while the retry budget allows it, so an outage does not double the load.
+
+    ASR_HTTP_ENDPOINT=http://127.0.0.1:8080/recognize   # Server giả để đo (benchmark_asr.py)
+"""
+
+import asyncio
+import json
+import os
+import time
+import aiohttp
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# ============================================
+# CONFIGURATION
+# ============================================
+ASR_HTTP_ENDPOINT = os.getenv('ASR_HTTP_ENDPOINT', 'http://www.google.com/speech-api/v2/recognize')
+ASR_HTTP_KEY = os.getenv('ASR_HTTP_KEY')  # Không đặt thì dùng key có sẵn trong speech_recognition (như recognize_google)
+ASR_HTTP_CONNECTIONS = int(os.getenv('ASR_HTTP_CONNECTIONS', '8'))  # Số kết nối giữ mở tối đa
+ASR_HTTP_KEEPALIVE = 60.0  # Giữ kết nối rảnh bấy nhiêu giây
+ASR_HTTP_CONNECT_TIMEOUT = 3.0  # Timeout kết nối (giây)
+ASR_HTTP_TIMEOUT = 8.0  # Timeout cả request (giây)
+ASR_HTTP_MAX_ATTEMPTS = 2  # Số lần gửi tối đa mỗi request (1 = không retry)
+ASR_HTTP_RETRY_BACKOFF = 0.1  # Chờ trước khi retry (giây, nhân với số lần đã thử)
+ASR_RETRY_BUDGET_RATIO = 0.2  # Mỗi request thành công cho thêm bấy nhiêu lượt retry
+ASR_RETRY_BUDGET_MAX = 10.0  # Số lượt retry tích lũy tối đa
+
+
+def default_key():
+    """The Web Speech API key speech_recognition's recognize_google uses when given none.
+
+    Read from the library at runtime so the key is not copied into this repo.
+    None if this speech_recognition version does not expose it.
+    """
+    try:
+        from speech_recognition.recognizers.google import create_request_builder
+        return create_request_builder(endpoint=ASR_HTTP_ENDPOINT).key
+    except (ImportError, AttributeError, TypeError):
+        return None
+
+
+class ASRRequestError(Exception):
+    """Raised when a recognition request failed (after any retries)."""
+
+
+class ASRServerError(ASRRequestError):
+    """5xx answer from the recognition server (worth a retry)."""
+
+
+class RetryBudget:
+    """Token bucket limiting retries to a fraction of successful requests."""
+
+    def __init__(self, ratio=ASR_RETRY_BUDGET_RATIO, max_tokens=ASR_RETRY_BUDGET_MAX):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+
+    def deposit(self):
+        self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self):
+        """Take one retry if the budget has it."""
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+def parse_response(text):
+    """n-best transcripts from a Web Speech API response, best first."""
+    # Server trả nhiều dòng JSON, dòng đầu thường là {"result":[]}
+    for line in text.split('\n'):
+        if not line.strip():
+            continue
+        results = json.loads(line).get('result', [])
+        if results:
+            alternatives = results[0].get('alternative', [])
+            return [alt['transcript'].strip().lower() for alt in alternatives if alt.get('transcript')]
+    return []
+
+
+class SpeechClient:
+    """Keep-alive aiohttp session for Web Speech API requests.
+
+    Only used from the event loop thread; the session is created on first use.
+    """
+
+    def __init__(self, endpoint=ASR_HTTP_ENDPOINT, key=ASR_HTTP_KEY, connections=ASR_HTTP_CONNECTIONS):
+        self.endpoint = endpoint
+        self.key = key or default_key()
+        self.connections = connections
+        self.session = None
+        self.budget = RetryBudget()
+        self.stats = {
+            'requests': 0,
+            'attempts': 0,
+            'retries': 0,
+            'retries_denied': 0,  # Lỗi nhưng hết retry budget
+            'failed': 0,
+            'timeouts': 0,
+            'connections_opened': 0,  # Thấp so với attempts = kết nối được dùng lại
+            'total_latency': 0.0,
+            'max_latency': 0.0,
+        }
+
+    def _get_session(self):
+        if self.session is None or self.session.closed:
+            trace = aiohttp.TraceConfig()
+            trace.on_connection_create_end.append(self._on_connection_created)
+            connector = aiohttp.TCPConnector(
+                limit=self.connections,
+                keepalive_timeout=ASR_HTTP_KEEPALIVE,
+            )
+            self.session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=ASR_HTTP_TIMEOUT, sock_connect=ASR_HTTP_CONNECT_TIMEOUT),
+                trace_configs=[trace],
+            )
+        return self.session
+
+    async def _on_connection_created(self, session, context, params):
+        self.stats['connections_opened'] += 1
+
+    async def _post(self, flac_data, sample_rate, language):
+        if not self.key:
+            raise ASRRequestError("no Web Speech API key - set ASR_HTTP_KEY in .env")
+        params = {'client': 'chromium', 'lang': language, 'key': self.key, 'pFilter': 0}
+        headers = {'Content-Type': f'audio/x-flac; rate={sample_rate}'}
+        async with self._get_session().post(self.endpoint, params=params, data=flac_data, headers=headers) as response:
+            if response.status >= 500:
+                raise ASRServerError(f"recognition server error {response.status}")
+            if response.status != 200:
+                # Lỗi 4xx (key sai, audio lỗi) thì retry cũng vô ích
+                raise ASRRequestError(f"recognition request failed ({response.status})")
+            return await response.text()
+
+    async def recognize(self, flac_data, sample_rate, language):
+        """Send one FLAC utterance. Returns the n-best transcripts, best first."""
+        self.stats['requests'] += 1
+        start = time.monotonic()
+        attempt = 0
+        while True:
+            attempt += 1
+            self.stats['attempts'] += 1
+            try:
+                text = await self._post(flac_data, sample_rate, language)
+                break
+            except (aiohttp.ClientError, asyncio.TimeoutError, ASRRequestError) as e:
+                if isinstance(e, asyncio.TimeoutError):
+                    self.stats['timeouts'] += 1
+                retryable = not isinstance(e, ASRRequestError) or isinstance(e, ASRServerError)
+                if not retryable or attempt >= ASR_HTTP_MAX_ATTEMPTS:
+                    self.stats['failed'] += 1
+                    raise ASRRequestError(f"recognition failed: {e!r}") from e
+                if not self.budget.withdraw():
+                    self.stats['retries_denied'] += 1
+                    self.stats['failed'] += 1
+                    raise ASRRequestError(f"recognition failed, retry budget exhausted: {e!r}") from e
+                self.stats['retries'] += 1
+                await asyncio.sleep(ASR_HTTP_RETRY_BACKOFF * attempt)
+
+        self.budget.deposit()
+        latency = time.monotonic() - start
+        self.stats['total_latency'] += latency
+        self.stats['max_latency'] = max(self.stats['max_latency'], latency)
+        return parse_response(text)
+
+    async def close(self):
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+
+    def get_stats(self):
+        """Request, retry and connection counters."""
+        stats = dict(self.stats)
+        done = stats['requests'] - stats['failed']
+        stats['avg_latency'] = stats['total_latency'] / done if done else 0.0
+        stats['retry_tokens'] = round(self.budget.tokens, 2)
+        return stats
+
+
+_speech_client = None
+
+def get_speech_client():
+    """Get the process-wide speech client (event loop thread only)."""
+    global _speech_client
+    if _speech_client is None:
+        _speech_client = SpeechClient()
+    return _speech_client
+
+async def close_speech_client():
+    """Close the speech client's HTTP session on shutdown, if a client was created."""
+    global _speech_client
+    if _speech_client is not None:
+        await _speech_client.close()
+        _speech_client = None
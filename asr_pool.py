@@ -0,0 +1,147 @@
+"""
+Dedicated worker pool for speech recognition jobs.
+
+ASR calls no longer share the default executor with yt-dlp and Spotify in
+music_player.py. Each guild has its own queue, guilds are served round-robin
+so one noisy server cannot starve the others, and a guild whose backlog goes
+over ASR_MAX_BACKLOG drops its oldest job. Jobs are either blocking
+functions (run on the pool's ASR_WORKERS threads) or coroutines such as
+HTTP requests (run on the event loop, at most ASR_ASYNC_JOBS at once).
+The two kinds have separate slots and queues, so a request waiting on the
+network never holds up wake-word spotting or FLAC encoding.
+"""
+
+import asyncio
+import os
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# ============================================
+# CONFIGURATION
+# ============================================
+ASR_WORKERS = int(os.getenv('ASR_WORKERS', '4'))  # Số thread nhận dạng chạy song song
+ASR_MAX_BACKLOG = int(os.getenv('ASR_MAX_BACKLOG', '4'))  # Số job chờ tối đa mỗi guild (mỗi loại job)
+# Số request async (HTTP) chạy cùng lúc, mặc định bằng số kết nối giữ mở của asr_client
+ASR_ASYNC_JOBS = int(os.getenv('ASR_ASYNC_JOBS') or os.getenv('ASR_HTTP_CONNECTIONS') or '8')
+
+
+class ASRJobDropped(Exception):
+    """Raised for a queued job that was dropped because its guild's backlog was full."""
+
+
+class ASRWorkerPool:
+    """Bounded thread pool with per-guild queues and round-robin scheduling.
+
+    Blocking and async jobs each have their own slot limit and per-guild
+    queues. Only used from the event loop thread; the blocking work runs on
+    the pool's own threads.
+    """
+
+    def __init__(self, max_workers=ASR_WORKERS, max_backlog=ASR_MAX_BACKLOG, max_async=ASR_ASYNC_JOBS):
+        self.max_workers = max_workers
+        self.max_async = max_async
+        self.max_backlog = max_backlog
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="asr")
+        # is_async -> OrderedDict guild_id -> deque of (fn, future, enqueue_time)
+        self.queues = {False: OrderedDict(), True: OrderedDict()}
+        self.running = {False: 0, True: 0}
+        self.stats = {
+            'submitted': 0,
+            'completed': 0,
+            'dropped': 0,  # Bỏ do backlog của guild quá dài
+            'cancelled': 0,  # Bị hủy trước khi chạy (không tốn request)
+            'total_wait': 0.0,
+            'max_wait': 0.0,
+        }
+
+    async def run(self, guild_id, fn):
+        """Run blocking fn on the pool, queued fairly behind other guilds."""
+        return await self._submit(guild_id, fn, False)
+
+    async def run_async(self, guild_id, fn):
+        """Await the coroutine returned by fn on the event loop, queued like run()."""
+        return await self._submit(guild_id, fn, True)
+
+    async def _submit(self, guild_id, fn, is_async):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        queue = self.queues[is_async].setdefault(guild_id, deque())
+        if len(queue) >= self.max_backlog:
+            _, old_future, _ = queue.popleft()
+            if not old_future.done():
+                old_future.set_exception(ASRJobDropped(f"ASR backlog full for guild {guild_id}"))
+            self.stats['dropped'] += 1
+        queue.append((fn, future, time.monotonic()))
+        self.stats['submitted'] += 1
+        self._dispatch(is_async)
+        return await future
+
+    def _dispatch(self, is_async):
+        queues = self.queues[is_async]
+        limit = self.max_async if is_async else self.max_workers
+        while self.running[is_async] < limit and queues:
+            # Round-robin: lấy job của guild đầu tiên rồi đưa guild xuống cuối
+            guild_id, queue = next(iter(queues.items()))
+            fn, future, enqueued = queue.popleft()
+            if queue:
+                queues.move_to_end(guild_id)
+            else:
+                del queues[guild_id]
+
+            if future.done():
+                self.stats['cancelled'] += 1
+                continue
+
+            wait = time.monotonic() - enqueued
+            self.stats['total_wait'] += wait
+            self.stats['max_wait'] = max(self.stats['max_wait'], wait)
+            self.running[is_async] += 1
+            if is_async:
+                job = asyncio.ensure_future(fn())
+                # Người gọi hủy (vd. đã có kết quả ngôn ngữ kia) -> hủy luôn request
+                future.add_done_callback(lambda future, job=job: job.cancel() if future.cancelled() else None)
+            else:
+                job = asyncio.wrap_future(self.executor.submit(fn))
+            job.add_done_callback(lambda job, future=future: self._on_done(job, future, is_async))
+
+    def _on_done(self, job, future, is_async):
+        self.running[is_async] -= 1
+        self.stats['completed'] += 1
+        if not future.done():
+            if job.cancelled():
+                future.cancel()
+            elif job.exception() is not None:
+                future.set_exception(job.exception())
+            else:
+                future.set_result(job.result())
+        self._dispatch(is_async)
+
+    def get_stats(self):
+        """Queue depth and wait time counters for sizing the pool."""
+        stats = dict(self.stats)
+        running = self.running[False] + self.running[True]
+        started = stats['completed'] + running
+        stats['running'] = running
+        stats['running_async'] = self.running[True]
+        stats['queue_depth'] = sum(len(q) for queues in self.queues.values() for q in queues.values())
+        depth = {}
+        for queues in self.queues.values():
+            for guild_id, q in queues.items():
+                depth[guild_id] = depth.get(guild_id, 0) + len(q)
+        stats['queue_depth_by_guild'] = depth
+        stats['avg_wait'] = stats['total_wait'] / started if started else 0.0
+        return stats
+
+
+_asr_pool = None
+
+def get_asr_pool():
+    """Get the process-wide ASR worker pool."""
+    global _asr_pool
+    if _asr_pool is None:
+        _asr_pool = ASRWorkerPool()
+    return _asr_pool
@@ -0,0 +1,295 @@
+"""
+NumPy audio primitives for the voice pipeline (replaces audioop).
+
+audioop is gone from the standard library in Python 3.13. Everything here
+works on int16 sample arrays and evaluates whole arrays at once: RMS over
+many frames in one call, stereo to mono, resampling with a stateful
+low-pass decimator (so packets can be fed one by one without seams),
+trimming of quiet edges and FLAC encoding for the ASR request.
+"""
+
+import io
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+# (Tùy chọn) Encode FLAC bằng libsndfile; không có thì dùng encoder NumPy bên dưới
+try:
+    import soundfile
+except ImportError:
+    soundfile = None
+
+# ============================================
+# CONFIGURATION
+# ============================================
+RESAMPLE_TAPS = 48  # Số hệ số bộ lọc chống alias khi giảm mẫu
+RESAMPLE_CUTOFF = 0.9  # Tần số cắt so với Nyquist của tần số đích
+
+
+def from_bytes(pcm):
+    """16-bit little-endian PCM bytes -> int16 array (no copy)."""
+    return np.frombuffer(pcm, dtype='<i2')
+
+
+def to_mono(stereo):
+    """Interleaved stereo int16 -> mono int16 (average of both channels)."""
+    stereo = stereo[:len(stereo) // 2 * 2].astype(np.int32)
+    return ((stereo[0::2] + stereo[1::2]) >> 1).astype(np.int16)
+
+
+def frame_rms(samples, frame_len):
+    """RMS of every whole frame_len-sample frame, as a float array."""
+    n_frames = len(samples) // frame_len
+    if n_frames == 0:
+        return np.zeros(0)
+    frames = samples[:n_frames * frame_len].reshape(n_frames, frame_len).astype(np.float64)
+    return np.sqrt(np.einsum('ij,ij->i', frames, frames) / frame_len)
+
+
+def rms(samples):
+    """RMS of the whole array."""
+    if len(samples) == 0:
+        return 0.0
+    samples = samples.astype(np.float64)
+    return float(np.sqrt(np.mean(samples * samples)))
+
+
+class Resampler:
+    """Streaming integer-factor downsampler (e.g. 48 kHz -> 16 kHz).
+
+    A windowed-sinc low-pass runs before decimation, and the filter history
+    and leftover samples carry over between calls, so feeding 20 ms packets
+    one at a time gives the same output as one big array.
+    """
+
+    def __init__(self, src_rate, dst_rate):
+        if src_rate % dst_rate:
+            raise ValueError(f"Resampler needs an integer ratio, got {src_rate} -> {dst_rate}")
+        self.factor = src_rate // dst_rate
+        taps = self._design(self.factor)[::-1]
+        # Bộ lọc dài bội số của factor -> chia thành ma trận (factor x n_blocks)
+        n_blocks = -(-len(taps) // self.factor)
+        taps = np.concatenate((taps, np.zeros(n_blocks * self.factor - len(taps))))
+        self.n_taps = len(taps)
+        self.blocks = np.ascontiguousarray(taps.reshape(n_blocks, self.factor).T, dtype=np.float32)
+        self.history = np.zeros(self.n_taps - 1, dtype=np.float32)
+        self.work = np.zeros(0, dtype=np.float32)  # Tái sử dụng giữa các packet cùng độ dài
+
+    @staticmethod
+    def _design(factor):
+        if factor == 1:
+            return np.ones(1)
+        n = np.arange(RESAMPLE_TAPS) - (RESAMPLE_TAPS - 1) / 2
+        cutoff = RESAMPLE_CUTOFF / factor
+        taps = cutoff * np.sinc(cutoff * n) * np.hamming(RESAMPLE_TAPS)
+        return taps / taps.sum()
+
+    def process(self, samples):
+        """Downsample the next chunk of int16 samples. Returns int16."""
+        n_history = len(self.history)
+        size = n_history + len(samples)
+        if len(self.work) != size:
+            self.work = np.empty(size, dtype=np.float32)
+        data = self.work
+        data[:n_history] = self.history
+        data[n_history:] = samples
+
+        factor = self.factor
+        n_blocks = self.blocks.shape[1]
+        n_out = (size - self.n_taps + 1) // factor
+        if n_out <= 0:
+            self.history = data.copy()
+            return np.zeros(0, dtype=np.int16)
+        # Chỉ tính các mẫu được giữ lại sau khi giảm mẫu: nhân từng khối factor
+        # mẫu với các đoạn của bộ lọc (1 phép nhân ma trận), rồi cộng theo đường chéo
+        n_rows = n_out + n_blocks - 1
+        partial = data[:n_rows * factor].reshape(n_rows, factor) @ self.blocks
+        row, col = partial.strides
+        out = as_strided(partial, (n_out, n_blocks), (row, row + col)).sum(axis=1)
+        self.history = data[n_out * factor:].copy()
+        np.clip(out, -32768, 32767, out=out)
+        return np.rint(out, out=out).astype(np.int16)
+
+
+def trim_bounds(samples, frame_len, threshold, pad_frames=0):
+    """(start, end) sample range left after cutting quiet edges (see trim); (0, 0) if all quiet."""
+    loud = np.flatnonzero(frame_rms(samples, frame_len) > threshold)
+    if len(loud) == 0:
+        return 0, 0
+    start = int(max(0, loud[0] - pad_frames)) * frame_len
+    end = min(len(samples), int(loud[-1] + 1 + pad_frames) * frame_len)
+    return start, end
+
+
+def trim(samples, frame_len, threshold, pad_frames=0):
+    """Cut leading/trailing frames whose RMS is at or below threshold, keeping pad_frames around speech.
+
+    Returns the trimmed view (empty if no frame is above threshold).
+    """
+    start, end = trim_bounds(samples, frame_len, threshold, pad_frames)
+    return samples[start:end]
+
+
+# ============================================
+# FLAC ENCODER (NumPy, mono 16-bit)
+# Fixed predictor + Rice residual, đủ cho request nhận dạng; không cần libsndfile hay chương trình flac
+# ============================================
+FLAC_BLOCK_SIZE = 4096  # Số sample mỗi frame FLAC
+FLAC_MAX_RICE_PARAM = 14  # 15 là mã escape
+FLAC_SAMPLE_RATE_CODES = {8000: 0b0100, 16000: 0b0101, 22050: 0b0110, 24000: 0b0111,
+                          32000: 0b1000, 44100: 0b1001, 48000: 0b1010, 96000: 0b1011}
+
+
+def _crc_table(poly, width):
+    top = 1 << (width - 1)
+    mask = (1 << width) - 1
+    table = []
+    for byte in range(256):
+        crc = byte << (width - 8)
+        for _ in range(8):
+            crc = ((crc << 1) ^ poly) & mask if crc & top else (crc << 1) & mask
+        table.append(crc)
+    return table
+
+_CRC8_TABLE = _crc_table(0x07, 8)
+_CRC16_TABLE = np.array(_crc_table(0x8005, 16), dtype=np.int64)
+# CRC-16 theo từng cặp byte: crc của 2 byte (hi, lo) bắt đầu từ 0
+_hi = _CRC16_TABLE[np.arange(65536) >> 8]
+_CRC16_PAIR_TABLE = (_hi << 8) & 0xFFFF ^ _CRC16_TABLE[(_hi >> 8) ^ (np.arange(65536) & 0xFF)]
+del _hi
+# CRC tuyến tính: chia dữ liệu thành khúc CRC_CHUNK byte, tính mọi khúc cùng lúc rồi ghép lại
+CRC_CHUNK = 64
+_CRC16_ADVANCE = np.arange(65536)  # Thanh ghi sau khi đẩy thêm CRC_CHUNK byte 0
+for _ in range(CRC_CHUNK // 2):
+    _CRC16_ADVANCE = _CRC16_PAIR_TABLE[_CRC16_ADVANCE]
+_CRC16_ADVANCE = _CRC16_ADVANCE.tolist()
+
+
+def _crc8(data):
+    crc = 0
+    for byte in data:
+        crc = _CRC8_TABLE[crc ^ byte]
+    return crc
+
+
+def _crc16(data):
+    """CRC-16 (poly 0x8005, FLAC frame footer)."""
+    head = len(data) % CRC_CHUNK
+    crc = 0
+    for byte in data[:head]:
+        crc = ((crc << 8) & 0xFFFF) ^ int(_CRC16_TABLE[(crc >> 8) ^ byte])
+    words = np.frombuffer(data, dtype='>u2', offset=head).reshape(-1, CRC_CHUNK // 2).astype(np.int64)
+    chunks = np.zeros(len(words), dtype=np.int64)
+    for column in words.T:
+        chunks = _CRC16_PAIR_TABLE[chunks ^ column]
+    # crc(A + B) = crc(A) đẩy qua len(B) byte 0, XOR crc(B)
+    for chunk in chunks.tolist():
+        crc = _CRC16_ADVANCE[crc] ^ chunk
+    return crc
+
+
+def _field_bits(values, widths):
+    """Bits (MSB first) of small fixed-width fields, as a uint8 0/1 array."""
+    values = np.asarray(values, dtype=np.uint64)
+    widths = np.asarray(widths, dtype=np.int64)
+    total = int(widths.sum())
+    starts = np.cumsum(widths) - widths
+    field = np.repeat(np.arange(len(widths)), widths)
+    shift = (widths[field] - 1 - (np.arange(total) - starts[field])).astype(np.uint64)
+    return ((values[field] >> shift) & np.uint64(1)).astype(np.uint8)
+
+
+def _rice_bits(folded, k):
+    """Rice code of zigzag-folded residuals: (folded >> k) zero bits, a one bit, then k low bits."""
+    quotient = (folded >> np.uint64(k)).astype(np.int64)
+    lengths = quotient + 1 + k
+    starts = np.cumsum(lengths) - lengths
+    bits = np.zeros(int(lengths.sum()), dtype=np.uint8)
+    stop = starts + quotient  # Vị trí bit 1 kết thúc phần unary
+    bits[stop] = 1
+    if k:
+        shifts = np.arange(k - 1, -1, -1, dtype=np.uint64)
+        low = (folded[:, None] >> shifts) & np.uint64(1)
+        bits[(stop + 1)[:, None] + np.arange(k)] = low
+    return bits
+
+
+def _rice_param(residual):
+    """Zigzag-folded residuals, the best Rice parameter and its cost in bits."""
+    folded = ((residual << 1) ^ (residual >> 63)).astype(np.uint64)  # Zigzag: 0,-1,1,-2 -> 0,1,2,3
+    n = len(folded)
+    # Tham số tốt nhất nằm quanh log2(trung bình), chỉ thử 3 giá trị
+    mean = float(folded.mean()) if n else 0.0
+    guess = min(int(np.log2(mean)), FLAC_MAX_RICE_PARAM) if mean >= 1 else 0
+    candidates = range(max(0, guess - 1), min(FLAC_MAX_RICE_PARAM, guess + 1) + 1)
+    cost, k = min((int((folded >> np.uint64(k)).sum()) + n * (k + 1), k) for k in candidates)
+    return folded, k, cost
+
+
+def _encode_flac_frame(block, index, rate_code, sample_rate):
+    # Header: sync, block size 16 bit ở cuối, sample rate, mono, 16-bit
+    header = bytearray([0xFF, 0xF8, 0x70 | rate_code, 0x08])
+    if index < 0x80:
+        header.append(index)
+    else:
+        # Số frame mã hóa kiểu UTF-8
+        header += chr(index).encode('utf-8', 'surrogatepass')
+    header += (len(block) - 1).to_bytes(2, 'big')
+    if rate_code == 0b1101:
+        header += sample_rate.to_bytes(2, 'big')
+    header.append(_crc8(header))
+
+    # Chọn bậc predictor (0-4) cho ít bit nhất; residual bậc n = sai phân bậc n
+    samples = block.astype(np.int64)
+    best = None
+    residual = samples
+    for order in range(min(4, len(block) - 1) + 1):
+        if order:
+            residual = np.diff(residual)
+        folded, k, cost = _rice_param(residual)
+        if best is None or cost + 16 * order < best[0]:
+            best = (cost + 16 * order, order, folded, k)
+    cost, order, folded, k = best
+
+    if cost + 10 >= 16 * len(block):
+        # Không nén được (nhiễu trắng) -> VERBATIM
+        body = bytes([0b00000010]) + block.astype('>i2').tobytes()
+    else:
+        head = _field_bits([(0b001000 | order) << 1] + (samples[:order] & 0xFFFF).tolist() + [0, 0, k],
+                           [8] + [16] * order + [2, 4, 4])
+        body = np.packbits(np.concatenate([head, _rice_bits(folded, k)])).tobytes()
+    frame = bytes(header) + body
+    return frame + _crc16(frame).to_bytes(2, 'big')
+
+
+def _encode_flac_numpy(samples, sample_rate):
+    rate_code = FLAC_SAMPLE_RATE_CODES.get(sample_rate, 0b1101 if sample_rate < 65536 else 0)
+    frames = [
+        _encode_flac_frame(samples[start:start + FLAC_BLOCK_SIZE], i, rate_code, sample_rate)
+        for i, start in enumerate(range(0, len(samples), FLAC_BLOCK_SIZE))
+    ]
+    # STREAMINFO: block size, frame size, sample rate, 1 kênh, 16 bit, số sample, MD5 = 0 (không tính)
+    block = min(FLAC_BLOCK_SIZE, max(16, len(samples)))
+    info = np.packbits(_field_bits(
+        [block, block, min(map(len, frames), default=0), max(map(len, frames), default=0),
+         sample_rate, 0, 15, len(samples), 0, 0],
+        [16, 16, 24, 24, 20, 3, 5, 36, 64, 64],
+    )).tobytes()
+    return b'fLaC' + bytes([0x80, 0, 0, len(info)]) + info + b''.join(frames)
+
+
+def encode_flac(pcm, sample_rate):
+    """16-bit mono PCM -> FLAC bytes, in process.
+
+    Uses soundfile (libsndfile) when it is installed, otherwise the NumPy
+    encoder above. speech_recognition's flac program (one subprocess per
+    call) is only a last resort if the NumPy encoder fails.
+    """
+    if soundfile is not None:
+        out = io.BytesIO()
+        soundfile.write(out, from_bytes(pcm), sample_rate, format='FLAC', subtype='PCM_16')
+        return out.getvalue()
+    try:
+        return _encode_flac_numpy(from_bytes(pcm), sample_rate)
+    except Exception:
+        import speech_recognition as sr
+        return sr.AudioData(bytes(pcm), sample_rate, 2).get_flac_data()
@@ -0,0 +1,170 @@
+"""
+Benchmark for recognition requests against a local stand-in for the Google Web Speech API.
+
+Starts an aiohttp server on 127.0.0.1 that answers like the real API after
+a fixed delay (and optionally fails some requests with 503), then sends the
+same FLAC utterance through:
+    client  - asr_client.SpeechClient on the event loop (keep-alive pool)
+    threads - speech_recognition.recognize_google on the ASR thread pool
+and reports latency, throughput and how many TCP connections were opened.
+Works offline; nothing is sent to Google.
+
+    python benchmark_asr.py                       # 200 requests, 8 at a time
+    python benchmark_asr.py --requests 500 --concurrency 32 --delay 0.05
+    python benchmark_asr.py --error-rate 0.2      # retry budget under failures
+"""
+
+import argparse
+import asyncio
+import math
+import random
+import struct
+import time
+
+import speech_recognition as sr
+from aiohttp import web
+
+from asr_client import SpeechClient
+from asr_pool import ASRWorkerPool
+from audio_ops import encode_flac
+
+SAMPLE_RATE = 16000
+RESPONSE = (
+    '{"result":[]}\n'
+    '{"result":[{"alternative":[{"transcript":"luna skip","confidence":0.9},'
+    '{"transcript":"luna sky"}],"final":true}],"result_index":0}\n'
+)
+
+
+class StandInServer:
+    """Minimal /recognize endpoint that counts requests and connections."""
+
+    def __init__(self, delay, error_rate, seed=0):
+        self.delay = delay
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+        self.connections = set()
+        self.requests = 0
+        self.runner = None
+        self.url = None
+
+    async def handle(self, request):
+        self.requests += 1
+        self.connections.add(request.transport)
+        await request.read()
+        await asyncio.sleep(self.delay)
+        if self.rng.random() < self.error_rate:
+            return web.Response(status=503)
+        return web.Response(text=RESPONSE, content_type='application/json')
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post('/recognize', self.handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f'http://127.0.0.1:{port}/recognize'
+
+    def reset(self):
+        self.connections = set()
+        self.requests = 0
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+
+def make_utterance(seconds=2.0):
+    """FLAC of a tone-like utterance (content does not matter to the stand-in)."""
+    samples = [int(3000 * math.sin(2 * math.pi * 220 * n / SAMPLE_RATE)) for n in range(int(seconds * SAMPLE_RATE))]
+    return encode_flac(struct.pack(f'<{len(samples)}h', *samples), SAMPLE_RATE)
+
+
+async def _run_requests(pool, requests, concurrency, job):
+    latencies = []
+    failures = 0
+    slots = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        nonlocal failures
+        async with slots:
+            start = time.perf_counter()
+            try:
+                await job(pool, i)
+                latencies.append(time.perf_counter() - start)
+            except Exception:
+                failures += 1
+
+    start = time.perf_counter()
+    # Giống nhiều guild cùng gửi: mỗi request một guild, luôn có `concurrency` request đang chạy
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    return latencies, failures, time.perf_counter() - start
+
+
+async def run_case(mode, server, flac_data, requests, concurrency):
+    pool = ASRWorkerPool(max_workers=concurrency, max_backlog=requests, max_async=concurrency)
+    server.reset()
+    client = None
+    if mode == 'client':
+        client = SpeechClient(endpoint=server.url, connections=concurrency)
+        job = lambda pool, i: pool.run_async(i, lambda: client.recognize(flac_data, SAMPLE_RATE, 'vi-VN'))
+    else:
+        recognizer = sr.Recognizer()
+        audio = sr.AudioData(b'', SAMPLE_RATE, 2)
+        audio.get_flac_data = lambda convert_rate=None, convert_width=None: flac_data
+        job = lambda pool, i: pool.run(i, lambda: recognizer.recognize_google(
+            audio, language='vi-VN', show_all=True, endpoint=server.url))
+    try:
+        latencies, failures, elapsed = await _run_requests(pool, requests, concurrency, job)
+    finally:
+        if client is not None:
+            await client.close()
+        pool.executor.shutdown(wait=False)
+
+    latencies.sort()
+    result = {
+        'mode': mode,
+        'requests_per_sec': requests / elapsed,
+        'p50_ms': latencies[len(latencies) // 2] * 1e3 if latencies else 0.0,
+        'p99_ms': latencies[int(len(latencies) * 0.99)] * 1e3 if latencies else 0.0,
+        'failed': failures,
+        'connections': len(server.connections),
+        'server_requests': server.requests,
+    }
+    if client is not None:
+        result['retries'] = client.get_stats()['retries']
+    return result
+
+
+async def main_async(args):
+    server = StandInServer(args.delay, args.error_rate)
+    await server.start()
+    flac_data = make_utterance()
+    print(f"Stand-in server: {server.url} (delay {args.delay * 1e3:.0f} ms, error rate {args.error_rate:.0%})")
+    print(f"{'mode':>8} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'failed':>7} {'conns':>6} {'sent':>6} {'retries':>8}")
+    try:
+        for mode in args.modes:
+            r = await run_case(mode, server, flac_data, args.requests, args.concurrency)
+            print(f"{r['mode']:>8} {r['requests_per_sec']:>8.0f} {r['p50_ms']:>8.1f} {r['p99_ms']:>8.1f} "
+                  f"{r['failed']:>7} {r['connections']:>6} {r['server_requests']:>6} {r.get('retries', '-'):>8}")
+    finally:
+        await server.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('modes', nargs='*', default=['client', 'threads'], help='client and/or threads')
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=8, help='Requests in flight at once')
+    parser.add_argument('--delay', type=float, default=0.02, help='Server think time per request (seconds)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests answered with 503')
+    args = parser.parse_args()
+    for mode in args.modes:
+        if mode not in ('client', 'threads'):
+            parser.error(f"unknown mode: {mode}")
+    asyncio.run(main_async(args))
+
+
+if __name__ == '__main__':
+    main()
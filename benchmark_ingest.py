@@ -0,0 +1,142 @@
+"""
+Micro-benchmark for DiscordSink.write(), the per-packet voice ingest path.
+
+Replays 20 ms 48 kHz stereo packets for 1, 5 and 20 simultaneous speakers on
+one thread (like the voice_recv router) as fast as possible, while the event
+loop runs in another thread with endpoint timers firing and a monitor polling
+the sink stats. Recognition is replaced by a no-op so only ingest is measured.
+
+    python benchmark_ingest.py            # 1, 5, 20 speakers, 3 s each
+    python benchmark_ingest.py 2 10 --seconds 5
+    python benchmark_ingest.py --locked   # speaker 1 holds the priority lock
+"""
+
+import argparse
+import asyncio
+import math
+import os
+import random
+import struct
+import threading
+import time
+from types import SimpleNamespace
+
+os.environ.setdefault('WAKE_SPOTTER', '0')  # Không load model Vosk khi đo
+
+import voiceInput
+
+PACKET_SAMPLES = 960  # 20 ms ở 48 kHz
+SPEECH_PACKETS = 60  # Mỗi speaker: 1.2 s nói ...
+PAUSE_PACKETS = 40  # ... rồi 0.8 s im lặng, lặp lại
+
+
+def make_packets(count=SPEECH_PACKETS + PAUSE_PACKETS, seed=0):
+    """Speech-like bursts (modulated harmonics + noise) followed by near-silence."""
+    rng = random.Random(seed)
+    packets = []
+    for i in range(count):
+        speaking = i < SPEECH_PACKETS
+        samples = []
+        for n in range(PACKET_SAMPLES):
+            t = (i * PACKET_SAMPLES + n) / voiceInput.CAPTURE_SAMPLE_RATE
+            if speaking:
+                envelope = 0.6 + 0.4 * math.sin(2 * math.pi * 4 * t)
+                value = envelope * (3000 * math.sin(2 * math.pi * 180 * t) + 1500 * math.sin(2 * math.pi * 360 * t))
+                value += rng.uniform(-300, 300)
+            else:
+                value = rng.uniform(-20, 20)
+            sample = int(max(-32768, min(32767, value)))
+            samples.extend((sample, sample))
+        packets.append(SimpleNamespace(pcm=struct.pack(f'<{len(samples)}h', *samples)))
+    return packets
+
+
+class _NullStrategy:
+    """Stands in for the vi/en strategy so endpoints never hit the network."""
+
+    backend = SimpleNamespace(name='null', supports_streaming=False)
+
+    async def recognize(self, pcm, sample_rate, user_id=None, guild_id=None):
+        return None
+
+    def get_stats(self):
+        return {}
+
+
+async def _monitor(sink, interval, stop):
+    while not stop.is_set():
+        sink.get_memory_stats()
+        sink.get_vad_stats()
+        await asyncio.sleep(interval)
+
+
+async def _lock(session, user_id):
+    session.lock_user(user_id)
+
+
+def run_case(speakers, seconds, packets, locked=False, monitor_interval=0.005):
+    """Packets/second pushed through one sink by `speakers` interleaved users."""
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+
+    bot = SimpleNamespace(loop=loop)
+    session = voiceInput.VoiceSession(guild_id=speakers)
+    sink = voiceInput.DiscordSink(bot, session)
+    sink.language_strategy = _NullStrategy()
+    if locked:
+        asyncio.run_coroutine_threadsafe(_lock(session, 1), loop).result()
+    stop = threading.Event()
+    monitor = asyncio.run_coroutine_threadsafe(_monitor(sink, monitor_interval, stop), loop)
+
+    # Speaker lệch pha nhau để không cùng lúc bắt đầu/kết thúc câu
+    offsets = [(user * 7) % len(packets) for user in range(speakers)]
+    latencies = []
+    sent = 0
+    start = time.perf_counter()
+    deadline = start + seconds
+    index = 0
+    while time.perf_counter() < deadline:
+        for user in range(speakers):
+            data = packets[(index + offsets[user]) % len(packets)]
+            t0 = time.perf_counter()
+            sink.write(user + 1, data)
+            latencies.append(time.perf_counter() - t0)
+        sent += speakers
+        index += 1
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    monitor.result()
+    sink.cleanup()
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    loop.close()
+
+    latencies.sort()
+    return {
+        'speakers': speakers,
+        'packets_per_sec': sent / elapsed,
+        'p50_us': latencies[len(latencies) // 2] * 1e6,
+        'p99_us': latencies[int(len(latencies) * 0.99)] * 1e6,
+        'max_us': latencies[-1] * 1e6,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('speakers', nargs='*', type=int, default=[1, 5, 20])
+    parser.add_argument('--seconds', type=float, default=3.0, help='Duration of each case')
+    parser.add_argument('--locked', action='store_true', help='Lock the session to speaker 1')
+    args = parser.parse_args()
+
+    packets = make_packets()
+    print(f"{'speakers':>8} {'packets/s':>11} {'p50 µs':>8} {'p99 µs':>8} {'max µs':>9}")
+    for speakers in args.speakers:
+        result = run_case(speakers, args.seconds, packets, locked=args.locked)
+        print(f"{result['speakers']:>8} {result['packets_per_sec']:>11.0f} "
+              f"{result['p50_us']:>8.1f} {result['p99_us']:>8.1f} {result['max_us']:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
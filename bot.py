@@ -8,9 +8,11 @@ logging.getLogger('discord.ext.voice_recv.gateway').setLevel(logging.WARNING)
 logging.getLogger('discord.ext.voice_recv.opus').setLevel(logging.WARNING)
 from discord.ext import commands
 from discord.ext import voice_recv
-from voiceInput import setup_sink, get_next_phrase, lock_user, unlock_user
-from music_player import add_to_queue, start_playback, get_current_song, add_playlist_to_queue
+from voiceInput import setup_sink, get_session, close_session, stop_playing
+from music_player import add_to_queue, start_playback, get_current_song, add_playlist_to_queue, get_player, remove_player
 from content_filter import filter_song_request
+from command_grammar import get_command_grammar, get_window_grammar
+from asr_client import close_speech_client
 import asyncio
 import difflib
 import random
@@ -18,54 +20,78 @@ import os
 import time
 from dotenv import load_dotenv
 
+load_dotenv()
+
+# ============================================
+# SHARDING (shard_launcher.py đặt SHARD_IDS / SHARD_COUNT cho từng process)
+# ============================================
+SHARD_COUNT = int(os.getenv('SHARD_COUNT', '0'))  # 0 = không shard, 1 process cho mọi guild
+SHARD_IDS = [int(i) for i in os.getenv('SHARD_IDS', '').split(',') if i.strip()] or None  # None = mọi shard
 
 intents = discord.Intents.default()
 intents.message_content = True
 intents.voice_states = True
-bot = commands.Bot(command_prefix="l", intents=intents, help_command=None)
 
-# 🔁 Song queue
-song_queue = []
 
-# 🎵 Currently playing song title
-current_song = None
+class LunaBot(commands.AutoShardedBot if SHARD_COUNT else commands.Bot):
+    """Bot (sharded when SHARD_COUNT is set) that also closes the ASR HTTP client on shutdown."""
+
+    async def close(self):
+        try:
+            await super().close()
+        finally:
+            # Đóng session HTTP keep-alive của ASR, tránh cảnh báo "Unclosed client session"
+            await close_speech_client()
+
 
-# 🛡️ Anti-overload protection
-_last_command_time = 0
+shard_options = {'shard_count': SHARD_COUNT, 'shard_ids': SHARD_IDS} if SHARD_COUNT else {}
+bot = LunaBot(command_prefix="l", intents=intents, help_command=None, **shard_options)
+
+# 🛡️ Anti-overload protection (trạng thái cooldown nằm trong GuildPlayer của từng guild)
 _command_cooldown = 2.0  # seconds between commands
-_is_processing = False
-_last_processed_text = ""
-_last_skip_time = 0  # Anti-duplicate for skip commands
+
+@bot.event
+async def on_command_error(ctx, error):
+    if isinstance(error, commands.NoPrivateMessage):
+        await ctx.send("❌ Lệnh này chỉ dùng được trong server.")
+        return
+    await commands.bot.BotBase.on_command_error(bot, ctx, error)
 
 @bot.event
 async def on_ready():
     print(f"✅ Logged in as {bot.user}")
+    if SHARD_COUNT:
+        print(f"🧩 Shards {sorted(bot.shards)} of {SHARD_COUNT} • {len(bot.guilds)} guilds")
 
 @bot.command()
 async def join(ctx):
     if ctx.author.voice:
         vc = await ctx.author.voice.channel.connect(cls=voice_recv.VoiceRecvClient)
         current_sink = setup_sink(vc, bot)
+        session = get_session(ctx.guild.id)  # Hàng đợi lệnh + lock ưu tiên riêng của guild này
+        player = get_player(ctx.guild.id)  # Queue, bài đang phát, cooldown riêng của guild này
+        grammar = get_command_grammar()
+        window_grammar = get_window_grammar()
         await ctx.send("🎤 Listening... Nói 'Lunaplay + tên bài' hoặc 'Luna mở bài + tên bài' để bật nhạc!")
 
         while True:
-            global _last_command_time, _is_processing, _last_processed_text, _last_skip_time
-            
-            wake_text = await get_next_phrase()
+            wake_text = await session.get_next_phrase()
+            if wake_text is None:
+                return  # Session đã đóng (bot rời kênh)
             spoken = wake_text.lower().strip()
             
             # 🛡️ ANTI-OVERLOAD: Skip if we're still processing or in cooldown
             current_time = time.time()
-            if _is_processing:
+            if player.is_processing:
                 print(f"[OVERLOAD] Skipping '{spoken[:30]}...' - still processing previous command")
                 continue
             
-            if current_time - _last_command_time < _command_cooldown:
+            if current_time - player.last_command_time < _command_cooldown:
                 print(f"[COOLDOWN] Skipping '{spoken[:30]}...' - cooldown active")
                 continue
             
             # 🛡️ Skip duplicate commands within short time
-            if spoken == _last_processed_text and current_time - _last_command_time < 5.0:
+            if spoken == player.last_processed_text and current_time - player.last_command_time < 5.0:
                 print(f"[DUPLICATE] Skipping duplicate command: '{spoken[:30]}...'")
                 continue
 
@@ -74,51 +100,43 @@ async def join(ctx):
             # These work anytime, even while music is playing
             # ============================================
             
-            # Define control command patterns (ALL require Luna wake word)
-            disconnect_commands = ["luna ngắt kết nối", "luna disconnect"]
-            skip_commands = ["luna skip", "luna chuyển bài", "luna bỏ qua"]
-            now_playing_commands = ["luna bài hiện tại", "luna now playing"]
+            # Intent + tên bài trong 1 lần duyệt (lệnh điều khiển đều cần wake word Luna)
+            match = grammar.match(spoken)
+            intent = match.intent if match else None
             
             # Check for leave/stop commands
-            if spoken in disconnect_commands:
+            if intent == 'disconnect':
                 await ctx.send("👋 Đã kết thúc phiên nghe nhạc.")
                 await ctx.voice_client.disconnect()
-                song_queue.clear()
+                close_session(ctx.guild.id)
+                remove_player(ctx.guild.id)
                 return
 
             # Check for skip commands
-            if spoken in skip_commands:
+            if intent == 'skip':
                 print(f"[DEBUG] Skip command detected: '{spoken}'")
                 
                 # Anti-duplicate: prevent multiple skip commands within 3 seconds
-                if current_time - _last_skip_time < 3.0:
+                if current_time - player.last_skip_time < 3.0:
                     print(f"[SKIP] Ignoring duplicate skip command (within 3s cooldown)")
                     continue
                 
                 # Check if there's something to skip (playing OR has queue)
-                has_music = ctx.voice_client and (ctx.voice_client.is_playing() or song_queue)
-                
-                if has_music:
-                    _last_skip_time = current_time  # Update last skip time
+                if player.has_music(ctx.voice_client):
+                    player.last_skip_time = current_time  # Update last skip time
                     print("[DEBUG] Stopping current track...")
                     if ctx.voice_client.is_playing():
-                        ctx.voice_client.stop()
+                        stop_playing(ctx.voice_client)  # Listener vẫn chạy, không cần dựng lại sink
                     await ctx.send("⏭️ Đang chuyển bài...")
-                    # Wait for the audio to finish stopping
-                    await asyncio.sleep(0.5)
-                    # Re-setup listener to ensure voice recognition continues
-                    print("[DEBUG] Re-setting up voice listener...")
-                    current_sink = setup_sink(vc, bot, force_restart=True)
-                    await asyncio.sleep(1.0)
-                    print("[DEBUG] Skip complete, listener reset, resuming voice recognition loop")
+                    print("[DEBUG] Skip complete, resuming voice recognition loop")
                 else:
                     await ctx.send("❌ Không có bài nào đang phát.")
                 print("[DEBUG] Continuing main loop after skip...")
                 continue
 
             # Check for now playing commands
-            if spoken in now_playing_commands:
-                song_info = get_current_song()
+            if intent == 'now_playing':
+                song_info = get_current_song(ctx.guild.id)
                 if song_info:
                     from music_player import format_duration
                     embed = discord.Embed(
@@ -139,34 +157,19 @@ async def join(ctx):
             # ============================================
             # WAKE PHRASE DETECTION (for playing new songs)
             # ============================================
-            wake_phrases = ["luna play", "luna mở bài"]
-            
-            # Sort by length desc to match longest phrase first
-            sorted_wake_phrases = sorted(wake_phrases, key=len, reverse=True)
-            
-            matched_wake = None
-            for p in sorted_wake_phrases:
-                if p in spoken:
-                    matched_wake = p
-                    break
-
-            if matched_wake:
+            if intent == 'play':
                 # 🛡️ Set processing lock
-                _is_processing = True
-                _last_command_time = time.time()
-                _last_processed_text = spoken
+                player.is_processing = True
+                player.last_command_time = time.time()
+                player.last_processed_text = spoken
                 
                 # 🔒 Lock to this user only (priority system)
-                lock_user(ctx.author.id)
+                session.lock_user(ctx.author.id)
                 
                 try:
                     # Check if there is a command included with the wake word
-                    # e.g. "mở bài sơn tùng" -> matched "mở bài", remainder "sơn tùng"
-                    initial_command = None
-                    if spoken.startswith(matched_wake):
-                        remainder = spoken[len(matched_wake):].strip()
-                        if remainder:
-                            initial_command = remainder
+                    # e.g. "luna mở bài sơn tùng" -> matched "luna mở bài", argument "sơn tùng"
+                    initial_command = match.argument or None
                     
                     # Start a timer window for next command
                     start_time = asyncio.get_event_loop().time()
@@ -179,7 +182,7 @@ async def join(ctx):
                             if first_pass and initial_command:
                                 command_text = initial_command
                             else:
-                                command_text = await asyncio.wait_for(get_next_phrase(), timeout=10.0)
+                                command_text = await asyncio.wait_for(session.get_next_phrase(), timeout=10.0)
                             
                             first_pass = False
                         except asyncio.TimeoutError:
@@ -188,37 +191,38 @@ async def join(ctx):
                             print(f"[ERROR] Command listen error: {e}")
                             break
 
+                        if command_text is None:
+                            return  # Session đã đóng (bot rời kênh)
+
                         if not command_text.strip():
                             continue
 
                         spoken_cmd = command_text.lower()
+                        cmd_match = window_grammar.match(spoken_cmd)
+                        cmd_intent = cmd_match.intent if cmd_match else None
                         
                         # Check for control commands inside the command window too
-                        if spoken_cmd in ["leave", "stop", "exit", "thoát", "cút"]:
+                        if cmd_intent == 'disconnect':
                             await ctx.send("👋 Đã kết thúc phiên nghe nhạc.")
                             await ctx.voice_client.disconnect()
-                            song_queue.clear()
+                            close_session(ctx.guild.id)
+                            remove_player(ctx.guild.id)
                             return
 
-                        elif spoken_cmd in ["skip", "next", "bỏ qua", "qua bài", "bài tiếp", "tiếp"]:
+                        elif cmd_intent == 'skip':
                             # Check if there's something to skip (playing OR has queue)
-                            has_music = ctx.voice_client and (ctx.voice_client.is_playing() or song_queue)
-                            
-                            if has_music:
+                            if player.has_music(ctx.voice_client):
                                 if ctx.voice_client.is_playing():
-                                    ctx.voice_client.stop()
+                                    stop_playing(ctx.voice_client)
                                 await ctx.send("⏭️ Đang chuyển bài...")
-                                # Re-setup voice listener
-                                await asyncio.sleep(0.5)
-                                setup_sink(vc, bot, force_restart=True)
                             else:
                                 await ctx.send("❌ Không có bài nào đang phát.")
                             continue
 
-                        elif spoken_cmd in ["now playing", "đang phát", "bài gì", "đang nghe gì", "what song", "this song", "bài này là gì"]:
-                            current = get_current_song()
+                        elif cmd_intent == 'now_playing':
+                            current = get_current_song(ctx.guild.id)
                             if current:
-                                await ctx.send(f"🎵 Đang phát: **{current}**")
+                                await ctx.send(f"🎵 Đang phát: **{current['title']}**")
                             else:
                                 await ctx.send("❌ Không có bài nào đang phát.")
                             continue
@@ -226,12 +230,7 @@ async def join(ctx):
                         # If not a control command, assume it's a song request
                         else:
                             # Remove any accidental trigger words if user still says them
-                            trigger_words = ["play music", "phát nhạc", "mở bài", "bật bài", "play bài", "mở", "play"]
-                            song_query = spoken_cmd                        
-                            for trigger in trigger_words:
-                                if spoken_cmd.startswith(trigger):
-                                    song_query = spoken_cmd.replace(trigger, "", 1).strip()
-                                    break
+                            song_query = cmd_match.argument if cmd_match else spoken_cmd.strip()
                             
                             if not song_query:
                                  continue
@@ -244,18 +243,17 @@ async def join(ctx):
                                 break
 
                             # ▶️ Now queue and play the song
-                            await add_to_queue(ctx, song_query, song_queue)
-                            await start_playback(ctx, song_queue)
-                            # Re-setup voice listener after starting playback
-                            await asyncio.sleep(0.5)
-                            setup_sink(vc, bot, force_restart=True)
+                            await add_to_queue(ctx, song_query)
+                            await start_playback(ctx)
+                            # Phát nhạc không dừng listener; chỉ nghe lại nếu listener đã tắt
+                            setup_sink(vc, bot)
                             break
                 finally:
                     # 🛡️ Release processing lock
-                    _is_processing = False
-                    _last_command_time = time.time()
+                    player.is_processing = False
+                    player.last_command_time = time.time()
                     # 🔓 Unlock user priority
-                    unlock_user()
+                    session.unlock_user()
             else:
                 print(f"[DEBUG] Ignored: '{wake_text}'")
             await asyncio.sleep(0.5)  # prevent loop spam
@@ -269,6 +267,7 @@ async def join(ctx):
 # ============================================
 
 @bot.command(name='play', aliases=['p'])
+@commands.guild_only()  # Queue / player / session theo guild, không dùng được trong DM
 async def play(ctx, *, query: str = None):
     """Play a song by text command. Usage: lplay <song name>"""
     if not query:
@@ -296,11 +295,10 @@ async def play(ctx, *, query: str = None):
     
     if is_playlist:
         print(f"[DEBUG] Detected playlist URL: {query}")
-        added = await add_playlist_to_queue(ctx, query, song_queue)
+        added = await add_playlist_to_queue(ctx, query)
         if added > 0:
-            await start_playback(ctx, song_queue)
-            # Re-setup voice listener after starting playback
-            await asyncio.sleep(0.5)
+            await start_playback(ctx)
+            # Bắt đầu nghe nếu chưa nghe (sink đang chạy thì giữ nguyên)
             if ctx.voice_client:
                 setup_sink(ctx.voice_client, bot)
         return
@@ -313,12 +311,11 @@ async def play(ctx, *, query: str = None):
     
     # Add to queue and play
     print(f"[DEBUG] Adding to queue: {query}")
-    await add_to_queue(ctx, query, song_queue)
-    print(f"[DEBUG] Queue after add: {len(song_queue)} items")
+    await add_to_queue(ctx, query)
+    print(f"[DEBUG] Queue after add: {len(get_player(ctx.guild.id).queue)} items")
     print(f"[DEBUG] Voice client playing: {ctx.voice_client.is_playing() if ctx.voice_client else 'No VC'}")
-    await start_playback(ctx, song_queue)
-    # Re-setup voice listener after starting playback
-    await asyncio.sleep(0.5)
+    await start_playback(ctx)
+    # Bắt đầu nghe nếu chưa nghe (sink đang chạy thì giữ nguyên)
     if ctx.voice_client:
         setup_sink(ctx.voice_client, bot)
     print(f"[DEBUG] After start_playback, playing: {ctx.voice_client.is_playing() if ctx.voice_client else 'No VC'}")
@@ -327,21 +324,19 @@ async def play(ctx, *, query: str = None):
 async def skip(ctx):
     """Skip the current song. Usage: lskip"""
     if ctx.voice_client and ctx.voice_client.is_playing():
-        ctx.voice_client.stop()
+        stop_playing(ctx.voice_client)
         await ctx.send("⏭️ Đang chuyển bài...")
-        # Re-setup voice listener after skip
-        await asyncio.sleep(0.5)
-        setup_sink(ctx.voice_client, bot, force_restart=True)
-        await asyncio.sleep(0.5)
     else:
         await ctx.send("❌ Không có bài nào đang phát.")
 
 @bot.command(name='queue', aliases=['q'])
+@commands.guild_only()
 async def queue(ctx):
     """Show the current queue. Usage: lqueue"""
-    from music_player import format_duration, get_current_song
+    from music_player import format_duration
     
-    if not song_queue and not get_current_song():
+    song_queue = get_player(ctx.guild.id).queue
+    if not song_queue and not get_current_song(ctx.guild.id):
         embed = discord.Embed(
             title="📭 Hàng đợi trống",
             description="Dùng `lplay <tên bài>` để thêm nhạc!",
@@ -362,7 +357,7 @@ async def queue(ctx):
         )
         
         # Show currently playing
-        current = get_current_song()
+        current = get_current_song(ctx.guild.id)
         if current:
             current_duration = format_duration(current.get('duration'))
             embed.add_field(
@@ -467,9 +462,10 @@ async def queue(ctx):
         await ctx.send(embed=create_queue_embed(0))
 
 @bot.command(name='nowplaying', aliases=['np', 'now'])
+@commands.guild_only()
 async def nowplaying(ctx):
     """Show the current playing song. Usage: lnowplaying or lnp"""
-    song_info = get_current_song()
+    song_info = get_current_song(ctx.guild.id)
     if song_info:
         from music_player import format_duration
         embed = discord.Embed(
@@ -490,17 +486,35 @@ async def stop(ctx):
     """Stop playing and leave the voice channel. Usage: lstop"""
     if ctx.voice_client:
         await ctx.voice_client.disconnect()
-        song_queue.clear()
+        close_session(ctx.guild.id)
+        remove_player(ctx.guild.id)
         await ctx.send("👋 Đã dừng phát nhạc và rời kênh.")
     else:
         await ctx.send("❌ Bot không ở trong voice channel.")
 
 @bot.command(name='clear', aliases=['c'])
+@commands.guild_only()
 async def clear(ctx):
     """Clear the queue. Usage: lclear"""
-    song_queue.clear()
+    get_player(ctx.guild.id).queue.clear()
     await ctx.send("🗑️ Đã xóa hàng đợi.")
 
+@bot.command(name='endpoint', aliases=['ep'])
+@commands.guild_only()
+async def endpoint(ctx, command_seconds: float = None, song_seconds: float = None):
+    """Show or set how long voice input waits for silence. Usage: lendpoint [lệnh] [tên bài]"""
+    session = get_session(ctx.guild.id)
+    if command_seconds is not None:
+        try:
+            session.set_endpointing(command_seconds, song_seconds)
+        except ValueError as e:
+            await ctx.send(f"❌ {e}")
+            return
+    await ctx.send(
+        f"⏱️ Chờ im lặng: **{session.command_silence_threshold:.1f}s** cho lệnh ngắn (skip, bài hiện tại, thoát), "
+        f"**{session.silence_threshold:.1f}s** cho tên bài hát."
+    )
+
 @bot.command(name='help', aliases=['h'])
 async def help_cmd(ctx):
     """Show help message. Usage: lhelp or lh"""
@@ -539,6 +553,7 @@ async def help_cmd(ctx):
             "lnowplaying     → Bài đang phát\n"
             "lskip           → Chuyển bài\n"
             "lclear          → Xóa hàng đợi\n"
+            "lendpoint       → Thời gian chờ im lặng\n"
             "lstop           → Dừng & rời kênh\n"
             "```"
         ),
@@ -570,10 +585,11 @@ async def help_cmd(ctx):
     await ctx.send(embed=embed)
 
 
-load_dotenv()
 TOKEN = os.getenv('DISCORD_TOKEN')
 
-if not TOKEN:
-    print("❌ Error: DISCORD_TOKEN not found in .env file.")
-else:
-    bot.run(TOKEN)
+# Guard: process DSP (spawn) import lại file này, không được chạy bot lần nữa
+if __name__ == "__main__":
+    if not TOKEN:
+        print("❌ Error: DISCORD_TOKEN not found in .env file.")
+    else:
+        bot.run(TOKEN)
@@ -0,0 +1,141 @@
+"""
+Compiled voice command grammar shared by voiceInput and bot.
+
+All command phrases are compiled once into a token trie. One pass over a
+transcript finds the intent ("skip", "play", ...) and where its phrase ends,
+so the rest of the text (the song name) comes out as the argument. Phrases
+only match on whole words: "luna" does not match inside "lunar". Adding a
+synonym adds a trie branch, not another scan over the text.
+
+    get_command_grammar().match("luna mở bài sơn tùng")  # intent 'play', argument 'sơn tùng'
+"""
+
+# ============================================
+# CONFIGURATION - Thêm từ đồng nghĩa tại đây
+# ============================================
+WAKE_WORDS = ["luna", "lu na", "lú na", "lủ na", "mở bài", "mở"]  # Từ khóa kích hoạt
+# ALL commands require Luna wake word to prevent accidental triggers
+CONTROL_COMMANDS = {
+    'disconnect': ["luna ngắt kết nối", "luna disconnect", "luna thoát", "luna cút", "luna bye"],
+    'skip': ["luna skip", "luna chuyển bài", "luna bỏ qua", "luna qua bài", "luna bài tiếp", "luna next"],
+    'now_playing': ["luna bài hiện tại", "luna đang phát", "luna bài gì", "luna now playing", "luna bài này là gì"],
+}
+PLAY_PHRASES = ["luna play", "luna mở bài"]  # + tên bài, ở bất kỳ đâu trong câu
+# Trong 10 giây sau "luna play" không cần nói "luna"
+WINDOW_COMMANDS = {
+    'disconnect': ["leave", "stop", "exit", "thoát", "cút"],
+    'skip': ["skip", "next", "bỏ qua", "qua bài", "bài tiếp", "tiếp"],
+    'now_playing': ["now playing", "đang phát", "bài gì", "đang nghe gì", "what song", "this song", "bài này là gì"],
+}
+TRIGGER_WORDS = ["play music", "phát nhạc", "mở bài", "bật bài", "play bài", "mở", "play"]  # Bỏ khỏi đầu tên bài
+
+# Cả câu phải đúng là lệnh (vd. "luna skip")
+EXACT = 'exact'
+# Cụm từ ở đầu câu, phần sau là tham số
+PREFIX = 'prefix'
+# Cụm từ ở bất kỳ đâu (theo ranh giới từ), phần sau là tham số
+ANYWHERE = 'anywhere'
+
+IMPORTANT_COMMANDS = [phrase for phrases in CONTROL_COMMANDS.values() for phrase in phrases]
+
+
+class CommandMatch:
+    """One grammar match: the intent, the phrase heard, and its token span."""
+
+    __slots__ = ('intent', 'phrase', 'start', 'end', 'tokens')
+
+    def __init__(self, intent, phrase, start, end, tokens):
+        self.intent = intent
+        self.phrase = phrase
+        self.start = start  # Token đầu của cụm từ
+        self.end = end  # Token ngay sau cụm từ (tham số bắt đầu từ đây)
+        self.tokens = tokens
+
+    @property
+    def argument(self):
+        """Text after the phrase (the song name for "play"), '' if none."""
+        return ' '.join(self.tokens[self.end:])
+
+    def __repr__(self):
+        return f"CommandMatch({self.intent!r}, {self.phrase!r}, argument={self.argument!r})"
+
+
+class CommandGrammar:
+    """Token trie over (intent, phrases, mode) rules.
+
+    Rules are listed by priority: a match of an earlier rule wins over any
+    match of a later one, wherever it is. Within a rule the leftmost, then
+    longest, phrase wins.
+    """
+
+    def __init__(self, rules):
+        self.root = {}
+        for rank, (intent, phrases, mode) in enumerate(rules):
+            for phrase in phrases:
+                tokens = phrase.lower().split()
+                node = self.root
+                for token in tokens:
+                    node = node.setdefault(token, {})
+                # Key None = cụm từ kết thúc ở node này
+                node.setdefault(None, []).append((rank, intent, mode, ' '.join(tokens)))
+
+    def match(self, text):
+        """Best CommandMatch for a transcript (lowercased, split on whitespace), or None."""
+        tokens = text.lower().split()
+        count = len(tokens)
+        root = self.root
+        best = None  # (rank, start, -end, entry)
+        for i in range(count):
+            node = root.get(tokens[i])
+            j = i + 1
+            while node is not None:
+                for entry in node.get(None, ()):
+                    rank, _, mode, _ = entry
+                    if mode == EXACT and (i != 0 or j != count):
+                        continue
+                    if mode == PREFIX and i != 0:
+                        continue
+                    key = (rank, i, -j)
+                    if best is None or key < best[:3]:
+                        best = key + (entry,)
+                if j == count:
+                    break
+                node = node.get(tokens[j])
+                j += 1
+        if best is None:
+            return None
+        _, start, end, (_, intent, _, phrase) = best
+        return CommandMatch(intent, phrase, start, -end, tokens)
+
+    def intent(self, text):
+        """Intent of a transcript, or None."""
+        match = self.match(text)
+        return match.intent if match else None
+
+    def is_control(self, text):
+        """Whether a transcript is exactly a control command ("luna skip")."""
+        return self.intent(text) in CONTROL_COMMANDS
+
+
+_command_grammar = None
+
+def get_command_grammar():
+    """Grammar for everything voice input hears: control commands, "luna play", wake words."""
+    global _command_grammar
+    if _command_grammar is None:
+        rules = [(intent, phrases, EXACT) for intent, phrases in CONTROL_COMMANDS.items()]
+        rules.append(('play', PLAY_PHRASES, ANYWHERE))
+        rules.append(('wake', WAKE_WORDS, ANYWHERE))
+        _command_grammar = CommandGrammar(rules)
+    return _command_grammar
+
+_window_grammar = None
+
+def get_window_grammar():
+    """Grammar for the command window after "luna play" (no wake word needed)."""
+    global _window_grammar
+    if _window_grammar is None:
+        rules = [(intent, phrases, EXACT) for intent, phrases in WINDOW_COMMANDS.items()]
+        rules.append(('play', TRIGGER_WORDS, PREFIX))
+        _window_grammar = CommandGrammar(rules)
+    return _window_grammar
@@ -0,0 +1,169 @@
+"""
+Optional process pool for the heavy per-utterance audio DSP.
+
+Opus decoding, downmix/resample to 16 kHz and FLAC encoding of finished
+utterances can run in a few worker processes instead of the bot process, so
+heavy speech traffic does not hold the GIL that the Discord gateway and the
+playback loop need. Audio goes in and out through shared memory segments;
+only the segment names cross the process boundary.
+
+    DSP_PROCESSES=0   # Mặc định: xử lý ngay trong process bot (server nhỏ)
+    DSP_PROCESSES=2   # 2 process riêng cho giải mã / encode
+
+Các hàm chạy trên thread worker (ASR pool, Opus decoder), không phải event loop.
+"""
+
+import multiprocessing
+import os
+import struct
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# ============================================
+# CONFIGURATION
+# ============================================
+DSP_PROCESSES = int(os.getenv('DSP_PROCESSES', '0'))  # 0 = không dùng process pool
+DSP_OUTPUT_SLACK = 64 * 1024  # Dư thêm cho output (header FLAC, sai số resample)
+
+
+def pack_opus_packets(packets):
+    """Serialize Opus packets (None = lost) as length-prefixed records."""
+    return b''.join(struct.pack('<H', len(p or b'')) + (p or b'') for p in packets)
+
+
+def unpack_opus_packets(data):
+    packets = []
+    offset = 0
+    while offset < len(data):
+        (size,) = struct.unpack_from('<H', data, offset)
+        offset += 2
+        packets.append(bytes(data[offset:offset + size]) or None)
+        offset += size
+    return packets
+
+
+def _op_decode_opus(data, sample_rate):
+    from opus_capture import decode_utterance
+    return decode_utterance(unpack_opus_packets(data), sample_rate)
+
+
+def _op_encode_flac(data, sample_rate):
+    from audio_ops import encode_flac
+    return encode_flac(data, sample_rate)
+
+
+DSP_OPS = {
+    'decode_opus': _op_decode_opus,
+    'encode_flac': _op_encode_flac,
+}
+
+
+def _run_job(op, in_name, in_size, out_name, out_capacity, params):
+    """Worker process side: read input segment, run op, write output segment.
+
+    Returns the output length, or the output bytes if it did not fit.
+    """
+    # Process bot tạo và unlink segment; worker (spawn) dùng chung resource tracker
+    source = shared_memory.SharedMemory(name=in_name)
+    try:
+        result = DSP_OPS[op](source.buf[:in_size], **params)
+    finally:
+        try:
+            source.close()
+        except BufferError:
+            # Op lỗi: traceback còn giữ view vào segment -> để GC đóng sau, giữ lỗi gốc
+            pass
+    if len(result) > out_capacity:
+        return bytes(result)
+    target = shared_memory.SharedMemory(name=out_name)
+    try:
+        target.buf[:len(result)] = result
+    finally:
+        target.close()
+    return len(result)
+
+
+class DSPPool:
+    """Runs DSP ops in worker processes, or inline when processes is 0."""
+
+    def __init__(self, processes=DSP_PROCESSES):
+        self.processes = processes
+        self.executor = None
+        if processes > 0:
+            # spawn: không fork process bot đang có thread voice/event loop
+            self.executor = ProcessPoolExecutor(
+                max_workers=processes,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+            print(f"✅ DSP process pool: {processes} processes")
+        self.stats = {'jobs': 0, 'bytes_in': 0, 'bytes_out': 0, 'total_time': 0.0}
+        self.stats_lock = threading.Lock()  # run() được gọi từ nhiều thread
+
+    @property
+    def enabled(self):
+        return self.executor is not None
+
+    def run(self, op, data, out_capacity, **params):
+        """Run op on data and return its output. Blocks the calling thread."""
+        start = time.monotonic()
+        if not self.enabled:
+            result = DSP_OPS[op](data, **params)
+        else:
+            result = self._run_remote(op, data, out_capacity, params)
+        with self.stats_lock:
+            stats = self.stats
+            stats['jobs'] += 1
+            stats['bytes_in'] += len(data)
+            stats['bytes_out'] += len(result)
+            stats['total_time'] += time.monotonic() - start
+        return result
+
+    def _run_remote(self, op, data, out_capacity, params):
+        source = shared_memory.SharedMemory(create=True, size=max(1, len(data)))
+        target = shared_memory.SharedMemory(create=True, size=max(1, out_capacity))
+        try:
+            source.buf[:len(data)] = data
+            result = self.executor.submit(
+                _run_job, op, source.name, len(data), target.name, out_capacity, params
+            ).result()
+            if isinstance(result, int):
+                result = bytes(target.buf[:result])
+            return result
+        finally:
+            for segment in (source, target):
+                segment.close()
+                segment.unlink()
+
+    def decode_opus(self, packets, sample_rate):
+        """Decode an utterance's Opus packets to 16-bit mono PCM at sample_rate."""
+        out_capacity = len(packets) * sample_rate * 2 // 50 + DSP_OUTPUT_SLACK  # 20 ms mỗi gói
+        return self.run('decode_opus', pack_opus_packets(packets), out_capacity, sample_rate=sample_rate)
+
+    def encode_flac(self, pcm, sample_rate):
+        """FLAC-encode 16-bit mono PCM (what the Google Web Speech API expects)."""
+        return self.run('encode_flac', pcm, len(pcm) + DSP_OUTPUT_SLACK, sample_rate=sample_rate)
+
+    def get_stats(self):
+        """Job counters for sizing DSP_PROCESSES."""
+        with self.stats_lock:
+            stats = dict(self.stats)
+        stats['processes'] = self.processes
+        stats['avg_time'] = stats['total_time'] / stats['jobs'] if stats['jobs'] else 0.0
+        return stats
+
+
+_dsp_pool = None
+_dsp_pool_lock = threading.Lock()
+
+def get_dsp_pool():
+    """Get the process-wide DSP pool (safe to call from worker threads)."""
+    global _dsp_pool
+    with _dsp_pool_lock:
+        if _dsp_pool is None:
+            _dsp_pool = DSPPool()
+    return _dsp_pool
@@ -0,0 +1,154 @@
+"""
+Adaptive vi-VN / en-US recognition strategy for voice commands.
+
+Both languages are started together, but a vi-VN result that the arbitration
+would pick anyway (it contains a vi command) is accepted immediately and the
+en-US request is cancelled.
+Users who consistently speak one language only get that language queried.
+"""
+
+import asyncio
+from collections import deque
+
+# ============================================
+# CONFIGURATION
+# ============================================
+LANGUAGES = ("vi-VN", "en-US")
+VI_COMMANDS = ["luna", "chuyển bài", "ngắt kết nối", "bài hiện tại", "ngắt", "kết nối"]  # Ưu tiên tiếng Việt
+EN_LENGTH_RATIO = 0.7  # Cho bài hát: chọn tiếng Anh nếu dài >= 70% kết quả tiếng Việt
+PREFERENCE_WINDOW = 8  # Số lần nhận dạng gần nhất để học ngôn ngữ của user
+PREFERENCE_MIN_SAMPLES = 5  # Cần ít nhất bấy nhiêu mẫu trước khi chỉ hỏi 1 ngôn ngữ
+PREFERENCE_RATIO = 0.85  # Tỷ lệ thắng để coi là ngôn ngữ ưa thích
+PREFERENCE_RECHECK_EVERY = 10  # Cứ bấy nhiêu câu lại hỏi cả 2 ngôn ngữ để học lại
+
+
+class DualLanguageStrategy:
+    """Runs vi-VN and en-US recognition and picks one transcript."""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.history = {}  # user_id -> deque of winning languages
+        self.single_runs = {}  # user_id -> single-language runs since last full check
+        self.stats = {
+            'utterances': 0,
+            'asr_calls': 0,  # Requests actually started
+            'calls_skipped': 0,  # Never started thanks to the learned preference
+            'calls_cancelled': 0,  # Abandoned after an early control-command match
+        }
+
+    def get_stats(self):
+        """Snapshot of ASR call counters."""
+        stats = dict(self.stats)
+        stats['calls_saved'] = stats['calls_skipped'] + stats['calls_cancelled']
+        return stats
+
+    def is_early_match(self, language, text):
+        """Whether a single result is decisive on its own (no need to wait for the other).
+
+        Only a vi result can be: arbitrate() can still prefer vi over any en
+        result (vi command or length ratio), so en always waits for vi.
+        """
+        if language == "vi-VN":
+            # Original arbitration always prefers a vi result containing a vi command
+            return any(cmd in text for cmd in VI_COMMANDS)
+        return False
+
+    def arbitrate(self, vi_result, en_result):
+        """Pick between the two transcripts when both languages answered."""
+        if vi_result and en_result:
+            # Ưu tiên tiếng Việt cho các lệnh điều khiển
+            if any(cmd in vi_result for cmd in VI_COMMANDS):
+                return vi_result
+            # Cho bài hát, ưu tiên tiếng Anh
+            return en_result if len(en_result) >= len(vi_result) * EN_LENGTH_RATIO else vi_result
+        return vi_result or en_result
+
+    def preferred_language(self, user_id):
+        """The language this user consistently speaks, or None."""
+        history = self.history.get(user_id)
+        if not history or len(history) < PREFERENCE_MIN_SAMPLES:
+            return None
+        for language in LANGUAGES:
+            if history.count(language) >= PREFERENCE_RATIO * len(history):
+                return language
+        return None
+
+    def _record(self, user_id, language):
+        if user_id is None or language is None:
+            return
+        self.history.setdefault(user_id, deque(maxlen=PREFERENCE_WINDOW)).append(language)
+
+    async def _recognize_one(self, audio, language, guild_id):
+        self.stats['asr_calls'] += 1
+        try:
+            results = await self.backend.recognize(audio, language, guild_id=guild_id)
+            return results[0] if results else None
+        except Exception:
+            return None
+
+    async def recognize(self, pcm, sample_rate, user_id=None, guild_id=None):
+        """Recognize an utterance. Returns the chosen transcript or None."""
+        self.stats['utterances'] += 1
+        languages = [lang for lang in LANGUAGES if self.backend.supports(lang)]
+        if not languages:
+            return None
+        # Encode 1 lần, dùng chung cho mọi ngôn ngữ
+        audio = await self.backend.prepare(pcm, sample_rate, guild_id=guild_id)
+
+        # User quen nói 1 ngôn ngữ -> chỉ hỏi ngôn ngữ đó (thỉnh thoảng kiểm tra lại)
+        preferred = self.preferred_language(user_id)
+        if preferred in languages and len(languages) > 1:
+            runs = self.single_runs.get(user_id, 0)
+            if runs < PREFERENCE_RECHECK_EVERY:
+                self.single_runs[user_id] = runs + 1
+                text = await self._recognize_one(audio, preferred, guild_id)
+                if text:
+                    self.stats['calls_skipped'] += len(languages) - 1
+                    self._record(user_id, preferred)
+                    return text
+                # Không nghe được -> thử các ngôn ngữ còn lại
+                languages = [lang for lang in languages if lang != preferred]
+            else:
+                self.single_runs[user_id] = 0
+
+        return await self._race(audio, languages, user_id, guild_id)
+
+    async def _race(self, audio, languages, user_id, guild_id):
+        tasks = {
+            asyncio.create_task(self._recognize_one(audio, lang, guild_id)): lang
+            for lang in languages
+        }
+        results = {}
+        pending = set(tasks)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    language = tasks[task]
+                    text = task.result()
+                    results[language] = text
+                    if text and self.is_early_match(language, text):
+                        # Kết quả đã rõ ràng -> bỏ request còn lại
+                        self.stats['calls_cancelled'] += len(pending)
+                        self._record(user_id, language)
+                        return text
+        finally:
+            for task in pending:
+                task.cancel()
+
+        return self.pick(results, user_id)
+
+    def languages_for(self, user_id):
+        """Languages worth querying for this user (just the learned one, if any)."""
+        languages = [lang for lang in LANGUAGES if self.backend.supports(lang)]
+        preferred = self.preferred_language(user_id)
+        return [preferred] if preferred in languages else languages
+
+    def pick(self, results, user_id=None):
+        """Arbitrate finished results ({language: text}) and learn from the winner."""
+        vi_result = results.get("vi-VN")
+        en_result = results.get("en-US")
+        final_text = self.arbitrate(vi_result, en_result)
+        if final_text:
+            self._record(user_id, "vi-VN" if final_text == vi_result else "en-US")
+        return final_text
@@ -89,8 +89,41 @@ ytdl_playlist = youtube_dl.YoutubeDL({
 })
 
 
-# 🎵 Track currently playing song info
-_current_song_info = None
+# ============================================
+# PER-GUILD PLAYER STATE
+# ============================================
+class GuildPlayer:
+    """Playback state of one guild: queue, current track, voice command cooldown and skip state."""
+
+    def __init__(self, guild_id):
+        self.guild_id = guild_id
+        self.queue = []  # 🔁 Song queue
+        self.current_song = None  # 🎵 Info dict of the song playing now
+        # 🛡️ Anti-overload protection (lệnh giọng nói)
+        self.last_command_time = 0
+        self.is_processing = False
+        self.last_processed_text = ""
+        self.last_skip_time = 0  # Anti-duplicate for skip commands
+
+    def has_music(self, voice_client):
+        """Whether there is something to skip (playing OR has queue)."""
+        return bool(voice_client and (voice_client.is_playing() or self.queue))
+
+_players = {}  # guild_id -> GuildPlayer
+
+def get_player(guild_id):
+    """Get (or create) the player of a guild."""
+    player = _players.get(guild_id)
+    if player is None:
+        player = _players[guild_id] = GuildPlayer(guild_id)
+    return player
+
+def remove_player(guild_id):
+    """Forget a guild's player (queue and current song) after leaving the voice channel."""
+    player = _players.pop(guild_id, None)
+    if player is not None:
+        player.queue.clear()
+        player.current_song = None
 
 def extract_spotify_playlist_id(url):
     """Extract playlist ID from Spotify URL."""
@@ -267,24 +300,25 @@ def format_duration(seconds):
         secs = seconds % 60
         return f"{hours}:{minutes:02d}:{secs:02d}"
 
-def get_current_song():
-    """Returns info dict of the currently playing song, or None if nothing is playing."""
-    return _current_song_info
+def get_current_song(guild_id):
+    """Returns info dict of the song playing in a guild, or None if nothing is playing."""
+    player = _players.get(guild_id)
+    return player.current_song if player else None
 
 # 🎵 Add a playlist to the queue
-async def add_playlist_to_queue(ctx, playlist_url, queue, max_songs=100):
+async def add_playlist_to_queue(ctx, playlist_url, max_songs=100):
     """
-    Add all songs from a YouTube/Spotify playlist to the queue.
+    Add all songs from a YouTube/Spotify playlist to the guild's queue.
     
     Args:
         ctx: Discord context
         playlist_url: YouTube or Spotify playlist URL
-        queue: Song queue list
         max_songs: Maximum number of songs to add (default 100)
     
     Returns:
         Number of songs added
     """
+    queue = get_player(ctx.guild.id).queue
     try:
         # Detect playlist type
         is_spotify = 'spotify.com' in playlist_url or 'open.spotify' in playlist_url
@@ -480,7 +514,8 @@ async def resolve_lazy_song(song_info):
         return None
 
 # 🎵 Add a song to the queue
-async def add_to_queue(ctx, query, queue):
+async def add_to_queue(ctx, query):
+    queue = get_player(ctx.guild.id).queue
     original_query = query
     
     # 🔴 YOUTUBE DIRECT URL: Handle YouTube links directly without searching
@@ -752,8 +787,9 @@ async def add_to_queue(ctx, query, queue):
         print(f"[SEARCH] Last error: {last_error}")
 
 # ▶️ Start playing from the queue
-async def start_playback(ctx, queue):
-    global _current_song_info
+async def start_playback(ctx):
+    player = get_player(ctx.guild.id)
+    queue = player.queue
     
     if not queue or ctx.voice_client.is_playing() or ctx.voice_client.is_paused():
         return
@@ -780,19 +816,20 @@ async def start_playback(ctx, queue):
             # Try next song
             await asyncio.sleep(2)
             await loading_msg.delete()
-            await start_playback(ctx, queue)
+            await start_playback(ctx)
             return
         
         song_info = resolved
         await loading_msg.delete()
     
-    _current_song_info = song_info  # Track the current song
+    player.current_song = song_info  # Track the current song
     source = discord.FFmpegPCMAudio(song_info['url'], **ffmpeg_options)
 
     def after_play(_):
-        global _current_song_info
-        _current_song_info = None  # Clear when song ends
-        asyncio.run_coroutine_threadsafe(start_playback(ctx, queue), ctx.bot.loop)
+        player.current_song = None  # Clear when song ends
+        if _players.get(ctx.guild.id) is not player:
+            return  # Bot đã rời kênh (remove_player) -> không tạo lại player
+        asyncio.run_coroutine_threadsafe(start_playback(ctx), ctx.bot.loop)
 
     ctx.voice_client.play(source, after=after_play)
     
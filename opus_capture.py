@@ -0,0 +1,123 @@
+"""
+Opus passthrough capture for the voice pipeline.
+
+With CAPTURE_MODE=opus the sink asks discord-ext-voice-recv for the raw Opus
+packets instead of PCM, so the receive thread no longer decodes audio for
+every user in the channel. Speech is detected from packet sizes, and only
+utterances that are going to be recognized get decoded, on a worker thread,
+several utterances per job when they pile up.
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from discord.opus import Decoder
+from dsp_pool import get_dsp_pool
+from audio_ops import Resampler, from_bytes, to_mono
+from patch_opus import SILENCE_FRAME
+
+# ============================================
+# CONFIGURATION
+# ============================================
+OPUS_SILENCE_FRAME = b'\xf8\xff\xfe'  # Frame im lặng Discord gửi khi ngừng nói
+OPUS_VOICED_MIN_BYTES = 16  # Gói nhỏ hơn coi như im lặng / DTX
+OPUS_FRAME_MS = 20  # Discord luôn gửi frame 20 ms
+
+
+def is_voiced_packet(packet):
+    """Whether an Opus packet carries speech rather than silence/DTX (None = lost)."""
+    return bool(packet) and len(packet) >= OPUS_VOICED_MIN_BYTES and packet != OPUS_SILENCE_FRAME
+
+
+def decode_utterance(packets, sample_rate):
+    """Decode one utterance's packets to 16-bit mono PCM at sample_rate.
+
+    A fresh decoder per utterance; lost packets (None/empty) are concealed by
+    the decoder, corrupted ones too (silence only if concealment fails).
+    Downmix and resampling run once over the whole utterance.
+    """
+    decoder = Decoder()
+    parts = []
+    for packet in packets:
+        try:
+            parts.append(decoder.decode(packet or None, fec=False))
+        except Exception:
+            try:
+                parts.append(decoder.decode(None, fec=False))
+            except Exception:
+                parts.append(SILENCE_FRAME)
+    stereo = from_bytes(b''.join(parts))
+    return Resampler(Decoder.SAMPLING_RATE, sample_rate).process(to_mono(stereo)).tobytes()
+
+
+class OpusBatchDecoder:
+    """Decodes finished utterances on one worker thread.
+
+    Requests that arrive while a batch is running are collected and decoded
+    together in the next job. With DSP_PROCESSES the worker thread hands the
+    decoding to the DSP process pool. Only used from the event loop thread.
+    """
+
+    def __init__(self):
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="opus")
+        self.pending = []  # (packets, sample_rate, future)
+        self.running = False
+        self.stats = {'utterances': 0, 'packets': 0, 'batches': 0}
+
+    async def decode(self, packets, sample_rate):
+        """Decode one utterance. Returns its PCM."""
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((packets, sample_rate, future))
+        if not self.running:
+            self._flush()
+        return await future
+
+    def _flush(self):
+        batch, self.pending = self.pending, []
+        if not batch:
+            return
+        self.running = True
+        self.stats['batches'] += 1
+        self.stats['utterances'] += len(batch)
+        self.stats['packets'] += sum(len(packets) for packets, _, _ in batch)
+        job = asyncio.wrap_future(self.executor.submit(self._decode_batch, batch))
+        job.add_done_callback(lambda job: self._on_done(job, batch))
+
+    @staticmethod
+    def _decode_batch(batch):
+        results = []
+        dsp = get_dsp_pool()
+        for packets, sample_rate, _ in batch:
+            try:
+                results.append((dsp.decode_opus(packets, sample_rate), None))
+            except Exception as e:
+                results.append((None, e))
+        return results
+
+    def _on_done(self, job, batch):
+        self.running = False
+        if job.exception() is not None:
+            results = [(None, job.exception())] * len(batch)
+        else:
+            results = job.result()
+        for (_, _, future), (pcm, error) in zip(batch, results):
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(pcm)
+        self._flush()
+
+    def get_stats(self):
+        """Decode counters (utterances per batch shows how much batching happens)."""
+        return dict(self.stats)
+
+
+_opus_decoder = None
+
+def get_opus_decoder():
+    """Get the process-wide Opus batch decoder."""
+    global _opus_decoder
+    if _opus_decoder is None:
+        _opus_decoder = OpusBatchDecoder()
+    return _opus_decoder
@@ -5,14 +5,58 @@ import logging
 # The class is PacketDecoder, not Decoder
 original_decode_packet = recv_opus.PacketDecoder._decode_packet
 
+# 3840 bytes = 960 samples * 2 channels * 2 bytes/sample (20ms)
+FRAME_BYTES = 3840
+
+
+class ConcealedPCM(bytes):
+    """PCM the decoder made up for a lost packet (FEC / packet loss concealment), not real audio."""
+
+    __slots__ = ()
+
+
+class CorruptedPCM(ConcealedPCM):
+    """Stand-in PCM for a packet that failed to decode (concealed, or silence)."""
+
+    __slots__ = ()
+
+
+# Dùng chung 1 frame im lặng, không cấp phát mới mỗi lần lỗi
+SILENCE_FRAME = CorruptedPCM(FRAME_BYTES)
+
+# Bộ đếm toàn bộ process (thread nhận voice ghi, chỉ để xem)
+opus_stats = {'decoded': 0, 'concealed': 0, 'corrupted': 0, 'silence': 0}
+
+
 def patched_decode_packet(self, packet):
+    if not packet:
+        # Gói mất: voice_recv tự dùng FEC của gói sau hoặc PLC
+        try:
+            packet, pcm = original_decode_packet(self, packet)
+            opus_stats['concealed'] += 1
+            return packet, ConcealedPCM(pcm)
+        except Exception:
+            opus_stats['silence'] += 1
+            return packet, SILENCE_FRAME
     try:
-        return original_decode_packet(self, packet)
+        result = original_decode_packet(self, packet)
+        opus_stats['decoded'] += 1
+        return result
     except Exception as e:
         # print(f"[WARNING] Opus decode error: {e}")
-        # Return empty PCM data (silence)
-        # 3840 bytes = 960 samples * 2 channels * 2 bytes/sample (20ms)
-        return packet, b'\x00' * 3840 
+        opus_stats['corrupted'] += 1
+        try:
+            # PLC: decoder đoán tiếp từ audio trước đó thay vì chèn im lặng
+            return packet, CorruptedPCM(self._decoder.decode(None, fec=False))
+        except Exception:
+            opus_stats['silence'] += 1
+            return packet, SILENCE_FRAME
+
+
+def get_opus_stats():
+    """Packets decoded, concealed (lost), corrupted, and replaced by silence."""
+    return dict(opus_stats)
+
 
 recv_opus.PacketDecoder._decode_packet = patched_decode_packet
 print("✅ Applied Opus error patch (PacketDecoder)")
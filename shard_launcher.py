@@ -0,0 +1,176 @@
+"""
+Sharded launch mode: several bot processes, each serving a group of shards.
+
+One bot process runs voice receive, ffmpeg, yt-dlp extraction and ASR for
+every guild under one GIL. This launcher splits the shards into groups and
+starts one `python bot.py` per group (SHARD_IDS / SHARD_COUNT in its
+environment), so each process only handles its own guilds with its own
+ASR / DSP executors. A process that crashes is restarted on its own, with
+backoff; the other shards keep running. Exit code 0 (e.g. missing token)
+is treated as a deliberate stop and not restarted.
+
+    python shard_launcher.py                      # SHARD_COUNT shards in SHARD_PROCESSES processes
+    python shard_launcher.py --shards 8 --processes 4
+"""
+
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import time
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# ============================================
+# CONFIGURATION
+# ============================================
+SHARD_COUNT = int(os.getenv('SHARD_COUNT', '2'))  # Tổng số shard (Discord chia guild theo shard)
+SHARD_PROCESSES = int(os.getenv('SHARD_PROCESSES', '2'))  # Số process bot chạy song song
+SHARD_IDENTIFY_DELAY = 5.5  # Discord cho 1 shard đăng nhập mỗi 5 giây -> giãn thời điểm khởi động (giây)
+SHARD_RESTART_DELAY = 5.0  # Chờ trước khi khởi động lại shard bị crash (giây, gấp đôi mỗi lần crash liền)
+SHARD_RESTART_MAX_DELAY = 120.0  # Thời gian chờ tối đa giữa 2 lần khởi động lại (giây)
+SHARD_STABLE_TIME = 300.0  # Chạy được bấy nhiêu giây thì coi như ổn, reset backoff
+SHARD_POLL_INTERVAL = 1.0  # Kiểm tra process mỗi bấy nhiêu giây
+SHARD_SHUTDOWN_TIMEOUT = 10.0  # Chờ process tự thoát trước khi kill (giây)
+BOT_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bot.py')
+
+
+def split_shards(shard_count, processes):
+    """Split shard ids 0..shard_count-1 into `processes` contiguous groups."""
+    processes = max(1, min(processes, shard_count))
+    size, extra = divmod(shard_count, processes)
+    groups = []
+    start = 0
+    for i in range(processes):
+        end = start + size + (1 if i < extra else 0)
+        groups.append(list(range(start, end)))
+        start = end
+    return groups
+
+
+class ShardProcess:
+    """One bot process serving a group of shards, restarted with backoff when it crashes."""
+
+    def __init__(self, shard_ids, shard_count):
+        self.shard_ids = shard_ids
+        self.shard_count = shard_count
+        self.name = f"shard {shard_ids[0]}" if len(shard_ids) == 1 else f"shards {shard_ids[0]}-{shard_ids[-1]}"
+        self.process = None
+        self.started_at = 0.0
+        self.restart_at = None  # Thời điểm khởi động lại (sau crash)
+        self.restart_delay = SHARD_RESTART_DELAY
+        self.restarts = 0
+        self.stopped = False  # Thoát bình thường (exit code 0) -> không chạy lại
+
+    def start(self):
+        env = dict(os.environ)
+        env['SHARD_COUNT'] = str(self.shard_count)
+        env['SHARD_IDS'] = ','.join(str(i) for i in self.shard_ids)
+        self.process = subprocess.Popen([sys.executable, BOT_SCRIPT], env=env)
+        self.started_at = time.monotonic()
+        self.restart_at = None
+        print(f"🚀 [SUPERVISOR] Started {self.name} (pid {self.process.pid})")
+
+    def check(self, now):
+        """Restart the process if it crashed and its backoff has passed."""
+        if self.stopped:
+            return
+        if self.restart_at is not None:
+            if now >= self.restart_at:
+                self.restarts += 1
+                self.start()
+            return
+        code = self.process.poll()
+        if code is None:
+            if now - self.started_at >= SHARD_STABLE_TIME:
+                self.restart_delay = SHARD_RESTART_DELAY
+            return
+        if code == 0:
+            self.stopped = True
+            print(f"ℹ️ [SUPERVISOR] {self.name} exited normally, not restarting")
+            return
+        if now - self.started_at >= SHARD_STABLE_TIME:
+            self.restart_delay = SHARD_RESTART_DELAY
+        print(f"⚠️ [SUPERVISOR] {self.name} crashed (exit code {code}), restarting in {self.restart_delay:.0f}s")
+        self.restart_at = now + self.restart_delay
+        self.restart_delay = min(self.restart_delay * 2, SHARD_RESTART_MAX_DELAY)
+
+    @property
+    def running(self):
+        return self.process is not None and self.process.poll() is None
+
+    def terminate(self):
+        if self.running:
+            self.process.terminate()
+
+    def kill(self):
+        if self.running:
+            self.process.kill()
+
+
+class Supervisor:
+    """Starts every shard group, restarts crashed ones, and stops them all on SIGINT/SIGTERM."""
+
+    def __init__(self, shard_count, processes):
+        self.shards = [ShardProcess(ids, shard_count) for ids in split_shards(shard_count, processes)]
+        self.stopping = False
+
+    def _on_signal(self, signum, frame):
+        self.stopping = True
+
+    def run(self):
+        signal.signal(signal.SIGINT, self._on_signal)
+        signal.signal(signal.SIGTERM, self._on_signal)
+        try:
+            for i, shard in enumerate(self.shards):
+                if self.stopping:
+                    break
+                shard.start()
+                if i < len(self.shards) - 1:
+                    self._sleep(SHARD_IDENTIFY_DELAY * len(shard.shard_ids))
+            while not self.stopping and not all(shard.stopped for shard in self.shards):
+                now = time.monotonic()
+                for shard in self.shards:
+                    shard.check(now)
+                self._sleep(SHARD_POLL_INTERVAL)
+        finally:
+            self.shutdown()
+
+    def _sleep(self, seconds):
+        deadline = time.monotonic() + seconds
+        while not self.stopping and time.monotonic() < deadline:
+            time.sleep(max(0.0, min(SHARD_POLL_INTERVAL, deadline - time.monotonic())))
+
+    def shutdown(self):
+        """Ask every shard to exit, then kill the ones still running after the timeout."""
+        print("👋 [SUPERVISOR] Stopping all shards...")
+        for shard in self.shards:
+            shard.terminate()
+        deadline = time.monotonic() + SHARD_SHUTDOWN_TIMEOUT
+        while any(shard.running for shard in self.shards) and time.monotonic() < deadline:
+            time.sleep(0.2)
+        for shard in self.shards:
+            shard.kill()
+            if shard.restarts:
+                print(f"ℹ️ [SUPERVISOR] {shard.name} was restarted {shard.restarts} times")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--shards', type=int, default=SHARD_COUNT, help='Total number of shards')
+    parser.add_argument('--processes', type=int, default=SHARD_PROCESSES, help='Bot processes to run')
+    args = parser.parse_args()
+    if args.shards < 1 or args.processes < 1:
+        parser.error("--shards and --processes must be at least 1")
+    if not os.getenv('DISCORD_TOKEN'):
+        print("❌ Error: DISCORD_TOKEN not found in .env file.")
+        return
+    supervisor = Supervisor(args.shards, args.processes)
+    print(f"✅ [SUPERVISOR] {args.shards} shards in {len(supervisor.shards)} processes")
+    supervisor.run()
+
+
+if __name__ == '__main__':
+    main()
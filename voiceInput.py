@@ -1,79 +1,621 @@
 import wave
-import speech_recognition as sr
 from discord.ext import voice_recv
+from asr_backends import get_asr_backend
+from language_strategy import DualLanguageStrategy
+from wake_word import WakeWordSpotter
+from command_grammar import IMPORTANT_COMMANDS, WAKE_WORDS, get_command_grammar
+from asr_pool import ASRJobDropped, get_asr_pool
+from asr_client import get_speech_client
+from opus_capture import OPUS_FRAME_MS, get_opus_decoder, is_voiced_packet
+from patch_opus import ConcealedPCM, CorruptedPCM, get_opus_stats
+from audio_ops import Resampler, frame_rms, from_bytes, to_mono, trim_bounds
 import asyncio
-import audioop
+import numpy as np
+import os
 import time
-import threading
+import heapq
+import itertools
+import weakref
+from collections import deque
+from functools import partial
 
-# Global queue for recognized text
-text_queue = asyncio.Queue()
+try:
+    import webrtcvad
+except ImportError:
+    webrtcvad = None
+    print("⚠️ webrtcvad not installed - falling back to RMS voice detection (pip install webrtcvad-wheels)")
 
 # ============================================
 # CONFIGURATION - Điều chỉnh tại đây
 # ============================================
 DEBUG_MODE = False  # Tắt debug messages
 DEBUG_INTERVAL = 30  # Chỉ hiện debug mỗi 30 giây (nếu DEBUG_MODE = True)
-SILENCE_THRESHOLD = 1.5  # Thời gian im lặng trước khi xử lý (giây)
+SILENCE_THRESHOLD = 1.5  # Thời gian im lặng trước khi xử lý (giây) - câu mở như tên bài hát
+COMMAND_SILENCE_THRESHOLD = 0.5  # Im lặng đủ để chốt khi câu đã là lệnh điều khiển hoàn chỉnh (giây)
+COMMAND_MAX_LENGTH = 2.5  # Chỉ kiểm tra lệnh hoàn chỉnh với câu ngắn hơn (giây)
+ENDPOINT_LIMITS = (0.2, 5.0)  # Giới hạn khi chỉnh ngưỡng im lặng theo guild (giây)
 MIN_AUDIO_LENGTH = 0.8  # Độ dài tối thiểu của audio để xử lý (giây)
+TRIM_PAD_MS = 200  # Giữ lại bấy nhiêu ms trước/sau giọng nói khi cắt im lặng đầu/cuối câu
 RMS_THRESHOLD = 50  # Ngưỡng âm lượng để nhận voice (tăng lên để bỏ qua tiếng ồn nhỏ)
-WAKE_WORDS = ["luna", "lu na", "lú na", "lủ na", "mở bài", "mở"]  # Từ khóa kích hoạt
+NOISE_FLOOR_WINDOW = 5.0  # Ước lượng tiếng ồn nền của mỗi user trên bấy nhiêu giây audio gần nhất
+NOISE_FLOOR_PERCENTILE = 5  # Mức năng lượng thấp (phân vị %) coi là tiếng ồn nền
+NOISE_FLOOR_RATIO = 2.0  # Frame phải to hơn tiếng ồn nền bấy nhiêu lần mới tính là giọng nói
+NOISE_FLOOR_MIN_FRAMES = 100  # Chưa đủ số frame này (2 giây) thì chỉ dùng RMS_THRESHOLD
+NOISE_FLOOR_MAX_RMS = 800  # Ngưỡng thích ứng không vượt quá mức này (người nói nhỏ vẫn nghe được)
+VAD_AGGRESSIVENESS = 2  # Mức lọc của WebRTC VAD (0-3, càng cao càng khắt khe)
+VAD_FRAME_MS = 20  # Độ dài frame cho VAD (10, 20 hoặc 30 ms)
+VAD_WINDOW_FRAMES = 10  # Số frame dùng để làm mượt quyết định bắt đầu/kết thúc
+VAD_START_RATIO = 0.6  # Tỷ lệ frame có giọng nói trong window để bắt đầu câu
+VAD_END_RATIO = 0.9  # Tỷ lệ frame im lặng trong window để kết thúc câu (hangover)
 PRIORITY_LOCK_TIMEOUT = 15.0  # Thời gian giữ lock user (giây)
+# Wake word và lệnh điều khiển: xem command_grammar.py
+INGEST_BATCH_PACKETS = 4  # Gom bấy nhiêu packet 20ms của 1 user rồi mới xử lý audio (80ms)
+INGEST_BATCH_GAP = 0.1  # Packet cách nhau lâu hơn (giây) -> bỏ phần gom dở (đuôi im lặng)
+MAX_UTTERANCE_LENGTH = 15.0  # Độ dài tối đa của 1 câu nói, quá thì cắt và xử lý luôn (giây)
+BUFFER_POOL_SIZE = 4  # Số buffer rảnh giữ lại để tái sử dụng mỗi sink
+
+# Chế độ nhận dạng: "batch" (chờ im lặng rồi gửi cả câu) hoặc "streaming"
+# (đưa audio cho recognizer khi đang nói, cần backend hỗ trợ như vosk)
+RECOGNITION_MODE = os.getenv('RECOGNITION_MODE', 'batch').lower()
+STREAM_CHUNK_SECONDS = 0.2  # Gửi audio cho recognizer mỗi 200ms khi đang nói
+STREAM_STABLE_UPDATES = 2  # Số lần partial giữ nguyên là lệnh hoàn chỉnh thì chốt luôn
+
+# Kiểu audio nhận từ Discord: "pcm" (voice_recv giải mã mọi gói) hoặc "opus"
+# (giữ gói nén, chỉ giải mã câu sẽ được nhận dạng - nhẹ hơn khi kênh đông người)
+CAPTURE_MODE = os.getenv('CAPTURE_MODE', 'pcm').lower()
+
+# Discord gửi PCM 48kHz stereo 16-bit, nhận dạng giọng nói chỉ cần 16kHz mono
+CAPTURE_SAMPLE_RATE = 48000
+ASR_SAMPLE_RATE = 16000
+PCM_BYTES_PER_SECOND = ASR_SAMPLE_RATE * 2  # Bytes/giây trong buffer (mono 16-bit)
+STREAM_CHUNK_BYTES = int(PCM_BYTES_PER_SECOND * STREAM_CHUNK_SECONDS)
+
+# Bộ đếm câu theo user (get_user_stats); các lý do bỏ câu cộng lại thành "discarded"
+# (rejected_by_vad là tiếng động chưa thành câu, không tính vào "discarded")
+USER_DISCARD_KEYS = ('too_short', 'no_wake_word', 'locked_out')
+# Frame bị mất (decoder tự che) / hỏng (không giải mã được): đường truyền của user kém
+USER_FRAME_KEYS = ('frames', 'concealed_frames', 'corrupted_frames')
+USER_STAT_KEYS = ('utterances', 'sent_to_asr', 'rejected_by_vad') + USER_DISCARD_KEYS + USER_FRAME_KEYS
+
+# ============================================
+# PER-GUILD VOICE SESSIONS
+# Mỗi guild có sink, hàng đợi câu lệnh, lock ưu tiên và chống trùng riêng
+# ============================================
+DUPLICATE_COOLDOWN = 5.0  # Thời gian chờ trước khi chấp nhận cùng text (giây)
+
+class VoiceSession:
+    """Voice state of one guild: its sink, phrase queue, speaker lock and dedup state."""
+
+    def __init__(self, guild_id):
+        self.guild_id = guild_id
+        self.sink = None
+        self.text_queue = asyncio.Queue()  # Recognized text for this guild's join() loop
+        self.closed = False
+        
+        # SINGLE USER PRIORITY SYSTEM
+        # Chỉ nghe voice từ 1 user khi có lệnh được kích hoạt
+        # write() đọc active_user_id trên thread nhận voice, timeout do timer trên event loop lo
+        self.active_user_id = None  # User ID đang được ưu tiên
+        self.active_user_lock_time = 0  # Thời điểm bắt đầu lock
+        self._unlock_handle = None
+        
+        # Duplicate detection - ngăn command gửi nhiều lần
+        self.last_recognized_text = ""
+        self.last_recognized_time = 0
+        
+        # Endpointing theo guild: lệnh ngắn chốt nhanh, tên bài hát chờ lâu hơn
+        self.silence_threshold = SILENCE_THRESHOLD
+        self.command_silence_threshold = COMMAND_SILENCE_THRESHOLD
+
+    def set_endpointing(self, command_threshold=None, silence_threshold=None):
+        """Change this guild's silence thresholds (seconds). Raises ValueError if out of range."""
+        command_threshold = self.command_silence_threshold if command_threshold is None else command_threshold
+        silence_threshold = self.silence_threshold if silence_threshold is None else silence_threshold
+        low, high = ENDPOINT_LIMITS
+        for value in (command_threshold, silence_threshold):
+            if not low <= value <= high:
+                raise ValueError(f"threshold must be between {low} and {high} seconds")
+        if command_threshold > silence_threshold:
+            raise ValueError("command threshold must not exceed the song request threshold")
+        self.command_silence_threshold = command_threshold
+        self.silence_threshold = silence_threshold
+
+    def lock_user(self, user_id):
+        """Lock voice recognition to only listen to this user. Call from the event loop."""
+        if self._unlock_handle is not None:
+            self._unlock_handle.cancel()
+        self.active_user_id = user_id
+        self.active_user_lock_time = time.time()
+        # Auto-unlock after timeout
+        self._unlock_handle = asyncio.get_event_loop().call_later(PRIORITY_LOCK_TIMEOUT, self._lock_timeout)
+        print(f"[PRIORITY] 🔒 Locked to user: {user_id} (guild {self.guild_id})")
+
+    def _lock_timeout(self):
+        self._unlock_handle = None
+        print(f"[PRIORITY] ⏰ Lock timeout, unlocking user: {self.active_user_id}")
+        self.unlock_user()
+
+    def unlock_user(self):
+        """Unlock voice recognition to listen to everyone."""
+        if self._unlock_handle is not None:
+            self._unlock_handle.cancel()
+            self._unlock_handle = None
+        if self.active_user_id:
+            print(f"[PRIORITY] 🔓 Unlocked from user: {self.active_user_id} (guild {self.guild_id})")
+        self.active_user_id = None
+        self.active_user_lock_time = 0
+
+    def is_user_locked(self):
+        """Check if a specific user is locked."""
+        return self.active_user_id is not None
+
+    def is_allowed_user(self, user_id):
+        """Check if this user is allowed to speak."""
+        if not self.is_user_locked():
+            return True  # No lock, everyone can speak
+        return user_id == self.active_user_id  # Only locked user can speak
+
+    def get_active_user(self):
+        """Get the currently locked user ID."""
+        return self.active_user_id if self.is_user_locked() else None
+
+    async def put_phrase(self, text):
+        """Queue recognized text unless it repeats the last one within DUPLICATE_COOLDOWN."""
+        current_time = time.time()
+        
+        # Duplicate check - không gửi cùng text trong DUPLICATE_COOLDOWN giây
+        if (text == self.last_recognized_text and 
+            current_time - self.last_recognized_time < DUPLICATE_COOLDOWN):
+            print(f"[Voice] ⏳ Duplicate skipped: {text[:30]}...")
+            return
+        print(f"[Voice] ✅ Command accepted: {text}")
+        self.last_recognized_text = text
+        self.last_recognized_time = current_time
+        await self.text_queue.put(text)
+
+    async def get_next_phrase(self):
+        """Next recognized phrase for this guild, or None once the session is closed."""
+        if self.closed:
+            return None
+        return await self.text_queue.get()
+
+    def close(self):
+        """Stop the sink and wake up the join() loop waiting on this session."""
+        self.closed = True
+        self.unlock_user()
+        if self.sink is not None:
+            self.sink.cleanup()
+            self.sink = None
+        self.text_queue.put_nowait(None)
+
+_sessions = {}  # guild_id -> VoiceSession
+
+def get_session(guild_id):
+    """Get (or create) the voice session of a guild."""
+    session = _sessions.get(guild_id)
+    if session is None or session.closed:
+        session = _sessions[guild_id] = VoiceSession(guild_id)
+    return session
+
+def close_session(guild_id):
+    """Close and forget a guild's voice session (after leaving the voice channel)."""
+    session = _sessions.pop(guild_id, None)
+    if session is not None:
+        session.close()
+
+# ============================================
+# EVENT-DRIVEN ENDPOINTING
+# Một heap deadline dùng chung cho mọi sink, không polling
+# ============================================
+class EndpointScheduler:
+    """Shared deadline heap that fires per-user endpoint timers on the event loop.
+
+    Only one loop timer is armed at a time (for the earliest deadline), so the
+    scheduler costs nothing while nobody is speaking. Must only be touched from
+    the event loop thread.
+    """
+
+    def __init__(self, loop):
+        self.loop = loop
+        self._heap = []  # (deadline, seq, callback)
+        self._seq = itertools.count()
+        self._handle = None
+
+    def arm(self, deadline, callback):
+        """Run callback once time.monotonic() reaches deadline."""
+        heapq.heappush(self._heap, (deadline, next(self._seq), callback))
+        if self._heap[0][2] is callback:
+            self._reschedule()
+
+    def _reschedule(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        if self._heap:
+            delay = max(0.0, self._heap[0][0] - time.monotonic())
+            self._handle = self.loop.call_later(delay, self._fire)
+
+    def _fire(self):
+        self._handle = None
+        now = time.monotonic()
+        while self._heap and self._heap[0][0] <= now:
+            _, _, callback = heapq.heappop(self._heap)
+            try:
+                callback()
+            except Exception as e:
+                if DEBUG_MODE:
+                    print(f"[Voice] Endpoint timer error: {e}")
+        self._reschedule()
+
+_endpoint_scheduler = None
+
+def get_endpoint_scheduler(loop):
+    """Get the endpoint scheduler shared by every sink on this loop."""
+    global _endpoint_scheduler
+    if _endpoint_scheduler is None or _endpoint_scheduler.loop is not loop:
+        _endpoint_scheduler = EndpointScheduler(loop)
+    return _endpoint_scheduler
+
+# ============================================
+# VOICE ACTIVITY DETECTION
+# WebRTC VAD theo frame, có làm mượt để bỏ tiếng ồn/nhạc/bàn phím
+# ============================================
+class NoiseFloor:
+    """Running low percentile of one speaker's frame RMS (their mic's background noise).
+
+    Keeps the last NOISE_FLOOR_WINDOW seconds of frame energies in a ring.
+    A frame counts as loud once it is NOISE_FLOOR_RATIO times above the
+    floor, never below RMS_THRESHOLD and never above NOISE_FLOOR_MAX_RMS.
+    """
+
+    def __init__(self, frame_ms):
+        self.history = np.zeros(int(NOISE_FLOOR_WINDOW * 1000 / frame_ms))
+        self.pos = 0
+        self.filled = 0
+        self.level = 0.0
+        self.threshold = RMS_THRESHOLD
+
+    def update(self, energy):
+        """Add the RMS of new frames and recompute the floor."""
+        size = len(self.history)
+        energy = energy[-size:]
+        if len(energy) == 0:
+            return
+        self.history[(self.pos + np.arange(len(energy))) % size] = energy
+        self.pos = (self.pos + len(energy)) % size
+        self.filled = min(size, self.filled + len(energy))
+        if self.filled < NOISE_FLOOR_MIN_FRAMES:
+            return
+        # np.partition thay cho np.percentile (nhanh hơn ~20 lần, chạy mỗi batch)
+        k = self.filled * NOISE_FLOOR_PERCENTILE // 100
+        self.level = float(np.partition(self.history[:self.filled], k)[k])
+        self.threshold = min(max(RMS_THRESHOLD, self.level * NOISE_FLOOR_RATIO), NOISE_FLOOR_MAX_RMS)
+
+
+class VoiceActivityDetector:
+    """Per-user speech start/end decisions from WebRTC VAD frames.
+
+    Frames not above the speaker's adaptive noise floor (NoiseFloor) are
+    treated as unvoiced without calling the VAD; the RMS of all frames in a
+    chunk is computed in one vectorised call.
+    Speech starts once VAD_START_RATIO of the last VAD_WINDOW_FRAMES frames are
+    voiced and ends once VAD_END_RATIO of them are unvoiced. About
+    VAD_WINDOW_FRAMES frames of audio seen before the start are kept as
+    pre-roll so the first syllable is not cut off.
+    """
+
+    def __init__(self):
+        self.vad = webrtcvad.Vad(VAD_AGGRESSIVENESS) if webrtcvad else None
+        self.frame_samples = ASR_SAMPLE_RATE * VAD_FRAME_MS // 1000
+        self.noise_floor = NoiseFloor(VAD_FRAME_MS)
+        self.remainder = np.zeros(0, dtype=np.int16)
+        self.window = deque(maxlen=VAD_WINDOW_FRAMES)
+        self.preroll = deque()
+        self.preroll_bytes = 0
+        self.preroll_limit = VAD_WINDOW_FRAMES * self.frame_samples * 2
+        self.triggered = False
+        self.candidate = False  # Có frame giọng nói nhưng chưa đủ để bắt đầu câu
+
+    def _is_voiced(self, frame, loud):
+        if not loud:
+            return False
+        if self.vad is None:
+            return True
+        try:
+            return self.vad.is_speech(frame.tobytes(), ASR_SAMPLE_RATE)
+        except Exception:
+            return False
+
+    def _keep_preroll(self, chunk):
+        self.preroll.append(chunk)
+        self.preroll_bytes += len(chunk)
+        while len(self.preroll) > 1 and self.preroll_bytes - len(self.preroll[0]) >= self.preroll_limit:
+            self.preroll_bytes -= len(self.preroll.popleft())
+
+    def _clear_preroll(self):
+        self.preroll.clear()
+        self.preroll_bytes = 0
+
+    def process(self, pcm, samples):
+        """Feed one chunk of 16 kHz mono audio (pcm bytes and the same int16 samples).
+
+        Returns (speech, started, rejected): whether the chunk is inside speech,
+        whether speech started in this chunk, and whether a burst of sound just
+        died out without the VAD ever accepting it as speech.
+        """
+        started = False
+        rejected = False
+        if not self.triggered:
+            self._keep_preroll(pcm)
+
+        data = np.concatenate((self.remainder, samples)) if len(self.remainder) else samples
+        size = self.frame_samples
+        energy = frame_rms(data, size)
+        loud = energy > self.noise_floor.threshold
+        self.noise_floor.update(energy)
+        for i, frame_loud in enumerate(loud):
+            frame = data[i * size:(i + 1) * size]
+            frame_started, frame_rejected = self._step(self._is_voiced(frame, frame_loud))
+            started = started or frame_started
+            rejected = rejected or frame_rejected
+        self.remainder = data[len(loud) * size:]
+
+        return self.triggered or started, started, rejected
+
+    def _step(self, voiced):
+        """Push one frame decision through the start/end smoothing. Returns (started, rejected)."""
+        self.window.append(voiced)
+        voiced_count = sum(self.window)
+
+        if not self.triggered:
+            if voiced:
+                self.candidate = True
+            if voiced_count >= VAD_START_RATIO * VAD_WINDOW_FRAMES:
+                self.triggered = True
+                self.candidate = False
+                return True, False
+            if self.candidate and voiced_count == 0:
+                self.candidate = False
+                return False, True
+        elif len(self.window) - voiced_count >= VAD_END_RATIO * VAD_WINDOW_FRAMES:
+            self.triggered = False
+            self._clear_preroll()
+        return False, False
+
+    def take_preroll(self):
+        """Packets buffered before speech started (including the starting one)."""
+        packets = list(self.preroll)
+        self._clear_preroll()
+        return packets
+
+class OpusActivityDetector(VoiceActivityDetector):
+    """Speech start/end decisions straight from Opus packets, without decoding.
+
+    Discord clients only transmit while their own voice detection is open and
+    close with silence frames, so packet size is a usable voicing signal. The
+    same window smoothing and pre-roll as VoiceActivityDetector apply.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.vad = None
+        self.noise_floor = None  # Không có năng lượng khi chưa giải mã
+        self.preroll = deque(maxlen=VAD_WINDOW_FRAMES)  # 1 gói = 1 frame
+
+    def process(self, packet):
+        """Feed one Opus packet (None if lost). Same return value as VoiceActivityDetector.process."""
+        if not self.triggered:
+            self.preroll.append(packet)
+        started, rejected = self._step(is_voiced_packet(packet))
+        return self.triggered or started, started, rejected
+
+# ============================================
+# BOUNDED UTTERANCE BUFFERS
+# Buffer cấp phát sẵn, có giới hạn, tái sử dụng qua pool
+# ============================================
+class UtteranceBuffer:
+    """Fixed-capacity PCM buffer for one utterance, allocated once and reused.
+
+    Frames past the capacity are refused instead of growing the buffer, which
+    puts a hard cap on utterance length. The filled region is handed out as a
+    memoryview so recognition reads it without copying.
+    """
+
+    def __init__(self, capacity):
+        self.data = bytearray(capacity)
+        self.capacity = capacity
+        self.size = 0
+        self.capped = False  # Set once a frame was refused
+
+    def __len__(self):
+        return self.size
+
+    def write(self, pcm):
+        """Append a frame. Returns False (and drops it) if it does not fit."""
+        end = self.size + len(pcm)
+        if end > self.capacity:
+            self.capped = True
+            return False
+        self.data[self.size:end] = pcm
+        self.size = end
+        return True
+
+    def view(self):
+        """Zero-copy view of the filled region."""
+        return memoryview(self.data)[:self.size]
+
+    def reset(self):
+        self.size = 0
+        self.capped = False
 
 # ============================================
-# SINGLE USER PRIORITY SYSTEM
-# Chỉ nghe voice từ 1 user khi có lệnh được kích hoạt
+# LOCK-FREE INGEST
+# write() không lấy lock: mỗi user một hàng đợi 1 producer / 1 consumer
 # ============================================
-_active_user_id = None  # User ID đang được ưu tiên
-_active_user_lock_time = 0  # Thời điểm bắt đầu lock
-
-def lock_user(user_id):
-    """Lock voice recognition to only listen to this user."""
-    global _active_user_id, _active_user_lock_time
-    _active_user_id = user_id
-    _active_user_lock_time = time.time()
-    print(f"[PRIORITY] 🔒 Locked to user: {user_id}")
-
-def unlock_user():
-    """Unlock voice recognition to listen to everyone."""
-    global _active_user_id, _active_user_lock_time
-    if _active_user_id:
-        print(f"[PRIORITY] 🔓 Unlocked from user: {_active_user_id}")
-    _active_user_id = None
-    _active_user_lock_time = 0
-
-def is_user_locked():
-    """Check if a specific user is locked."""
-    global _active_user_id, _active_user_lock_time
-    if _active_user_id is None:
-        return False
-    # Auto-unlock after timeout
-    if time.time() - _active_user_lock_time > PRIORITY_LOCK_TIMEOUT:
-        print(f"[PRIORITY] ⏰ Lock timeout, unlocking user: {_active_user_id}")
-        unlock_user()
-        return False
-    return True
-
-def is_allowed_user(user_id):
-    """Check if this user is allowed to speak."""
-    global _active_user_id
-    if not is_user_locked():
-        return True  # No lock, everyone can speak
-    return user_id == _active_user_id  # Only locked user can speak
-
-def get_active_user():
-    """Get the currently locked user ID."""
-    return _active_user_id if is_user_locked() else None
+class SpeakerState:
+    """Ingest state of one speaker, only touched by the voice receive thread."""
+
+    __slots__ = ('resampler', 'raw', 'raw_time', 'vad', 'utterance')
+
+    def __init__(self, vad):
+        self.resampler = Resampler(CAPTURE_SAMPLE_RATE, ASR_SAMPLE_RATE)
+        self.raw = []  # Packet 48kHz stereo đang gom cho lần xử lý tiếp theo
+        self.raw_time = 0.0  # Lúc nhận packet gom gần nhất
+        self.vad = vad
+        self.utterance = None  # PendingUtterance đang ghi
+
+
+class PendingUtterance:
+    """One utterance's audio, queued by the receive thread for the event loop.
+
+    The receive thread is the only producer: it appends 16 kHz frames to
+    `frames` and bumps last_speak_time. The event loop is the only consumer:
+    it drains `frames` into `buffer` when it needs the audio (streaming feed
+    or endpoint). deque.append/popleft are atomic, so neither side locks.
+    Either side may set `ended`; the next speech frame then opens a new
+    utterance, except after a capped one, which must be taken first so a
+    speaker never has more than one full buffer waiting. buffer, stream and
+    done belong to the event loop.
+    """
+
+    __slots__ = ('frames', 'queued_bytes', 'signalled_bytes', 'last_speak_time',
+                 'silence_threshold', 'probe_time', 'timer', 'ended', 'capped', 'buffer', 'stream', 'done')
+
+    def __init__(self, now, silence_threshold):
+        self.frames = deque()
+        self.queued_bytes = 0
+        self.signalled_bytes = 0  # queued_bytes lúc báo chunk streaming gần nhất
+        self.last_speak_time = now
+        self.silence_threshold = silence_threshold  # Event loop rút ngắn khi câu đã là lệnh
+        self.probe_time = None  # last_speak_time lúc kiểm tra lệnh gần nhất (event loop)
+        self.timer = 0  # Thế hệ timer endpoint, callback cũ hơn thì bỏ qua (event loop)
+        self.ended = False
+        self.capped = False  # Đạt MAX_UTTERANCE_LENGTH
+        self.buffer = None
+        self.stream = None
+        self.done = False  # Đã giao cho nhận dạng hoặc bị bỏ
+
+    def push(self, frame, size, capacity):
+        """Queue a frame worth size bytes of 16 kHz PCM. Returns False if it would exceed capacity."""
+        if self.queued_bytes + size > capacity:
+            return False
+        self.frames.append(frame)
+        self.queued_bytes += size
+        return True
+
+# ============================================
+# STREAMING RECOGNITION
+# Nhận dạng dần khi user còn đang nói
+# ============================================
+class UserStream:
+    """Streaming recognition state for one user's current utterance.
+
+    feed()/finish() block and run on ASR pool threads; self.lock keeps them in
+    order. fed is how much of buffer the recognizers have already seen.
+    """
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self.languages = None  # Chọn trên event loop ở lần feed đầu
+        self.streams = {}  # language -> RecognitionStream
+        self.fed = 0
+        self.scheduled = False  # Đã có task feed đang chờ/chạy
+        self.closed = False
+        self.lock = asyncio.Lock()
+        self.last_command = None
+        self.stable_count = 0
+
+    def feed(self, backend, pcm):
+        """Feed PCM to every language. Returns {language: partial}."""
+        partials = {}
+        for language in self.languages:
+            stream = self.streams.get(language)
+            if stream is None:
+                stream = self.streams[language] = backend.open_stream(language, ASR_SAMPLE_RATE)
+            partials[language] = stream.feed(pcm)
+        return partials
+
+    def finish(self, backend, pcm):
+        """Feed the last PCM and close the recognizers. Returns {language: best text}."""
+        if pcm or not self.streams:
+            self.feed(backend, pcm)
+        results = {}
+        for language, stream in self.streams.items():
+            texts = stream.finish()
+            results[language] = texts[0] if texts else None
+        return results
+
+    def stable_command(self, partials):
+        """A complete control command once it stayed the hypothesis for STREAM_STABLE_UPDATES feeds."""
+        grammar = get_command_grammar()
+        command = next((text for text in partials.values() if text and grammar.is_control(text)), None)
+        if command is not None and command == self.last_command:
+            self.stable_count += 1
+        else:
+            self.last_command = command
+            self.stable_count = 1 if command else 0
+        return command if self.stable_count >= STREAM_STABLE_UPDATES else None
+
+_language_strategy = None
+
+def get_language_strategy():
+    """Get the vi/en strategy shared by every sink (keeps learned user preferences)."""
+    global _language_strategy
+    if _language_strategy is None:
+        _language_strategy = DualLanguageStrategy(get_asr_backend())
+    return _language_strategy
+
+_wake_spotter = None
+
+def get_wake_spotter():
+    """Get the local wake word spotter shared by every sink."""
+    global _wake_spotter
+    if _wake_spotter is None:
+        _wake_spotter = WakeWordSpotter(WAKE_WORDS)
+    return _wake_spotter
+
+_command_spotter = None
+
+def get_command_spotter():
+    """Get the spotter that recognizes complete control commands (for early endpointing)."""
+    global _command_spotter
+    if _command_spotter is None:
+        _command_spotter = WakeWordSpotter(IMPORTANT_COMMANDS, window=COMMAND_MAX_LENGTH)
+    return _command_spotter
+
+# ============================================
+# SINK TASK REGISTRY
+# Task nền của sink được cancel trong cleanup(), bộ đếm để kiểm tra rò rỉ khi chạy lâu
+# ============================================
+_sink_task_stats = {'live': 0, 'started': 0, 'cancelled': 0}
+_live_sinks = weakref.WeakSet()  # Sink còn trong bộ nhớ (kể cả đã cleanup nhưng chưa được thu hồi)
+
+def get_sink_task_stats():
+    """Live/started/cancelled background tasks over all sinks, plus sinks still in memory."""
+    stats = dict(_sink_task_stats)
+    stats['live_sinks'] = len(_live_sinks)
+    return stats
 
 class DiscordSink(voice_recv.AudioSink):
-    def __init__(self, bot):
+    """Collects each speaker's utterances and hands them to recognition.
+
+    write() runs on the voice receive thread and never takes a lock: per-user
+    ingest state lives in SpeakerState (receive thread only) and audio is
+    handed over through PendingUtterance queues. Everything else in the sink
+    (buffers, endpoint timers, streams, rate limits) belongs to the event loop.
+    """
+
+    def __init__(self, bot, session):
         super().__init__()
         self.bot = bot
-        self.buffers = {}  # user_id -> bytearray
-        self.last_speak_time = {}  # user_id -> time
-        self.recognizer = sr.Recognizer()
+        self.session = session  # Hàng đợi câu lệnh, lock ưu tiên của guild
+        self.guild_id = session.guild_id  # Hàng đợi ASR công bằng theo guild
+        self.speakers = {}  # user_id -> SpeakerState (chỉ thread nhận voice)
+        self.language_strategy = get_language_strategy()  # Dùng chung, giữ ngôn ngữ đã học của user
+        self.wake_spotter = get_wake_spotter()  # Lọc câu không có "Luna" trước khi gọi ASR
+        self.command_spotter = get_command_spotter()  # Câu đã là lệnh hoàn chỉnh -> chốt sớm
+        self.grammar = get_command_grammar()
         self.start_time = time.time()
-        self.lock = threading.Lock()
         self.write_counter = 0
         self.last_debug_time = time.time()
         
@@ -82,57 +624,358 @@ class DiscordSink(voice_recv.AudioSink):
         self.last_process_time = {}  # user_id -> time (để rate limit)
         self.pending_users = set()  # Users đang được xử lý
         
-        # Duplicate detection - ngăn command gửi nhiều lần
-        self.last_recognized_text = ""
-        self.last_recognized_time = 0
-        self.DUPLICATE_COOLDOWN = 5.0  # Thời gian chờ trước khi chấp nhận cùng text (giây)
+        # Endpointing theo deadline: write() arm timer khi bắt đầu câu mới
+        self.scheduler = get_endpoint_scheduler(self.bot.loop)
+        self.utterances = set()  # PendingUtterance chưa chốt (event loop)
+        self.deferred = {}  # user_id -> [PendingUtterance] hết im lặng khi đang được xử lý
+        self.tasks = set()  # Task nền đang chạy, cancel trong cleanup()
+        self.closed = False
+        _live_sinks.add(self)
+        
+        # Pool buffer + bộ đếm bộ nhớ (để kiểm tra giới hạn khi tải cao)
+        self.buffer_capacity = int(PCM_BYTES_PER_SECOND * MAX_UTTERANCE_LENGTH)
+        self.buffer_pool = []  # UtteranceBuffer rảnh
+        self.memory_stats = {
+            'allocated_bytes': 0,  # Tổng bộ nhớ buffer đang cấp phát
+            'peak_allocated_bytes': 0,
+            'dropped_bytes': 0,  # Audio bị bỏ do vượt MAX_UTTERANCE_LENGTH
+            'capped_utterances': 0,
+        }
         
-        self.bot.loop.create_task(self.check_silence())
+        # Streaming chỉ bật được khi backend hỗ trợ
+        self.streaming = RECOGNITION_MODE == 'streaming' and self.language_strategy.backend.supports_streaming
+        if RECOGNITION_MODE == 'streaming' and not self.streaming:
+            print(f"⚠️ ASR backend '{self.language_strategy.backend.name}' has no streaming, using batch mode")
         
+        # Bộ đếm VAD: số câu bị VAD loại so với số câu gửi đi nhận dạng
+        self.vad_stats = {
+            'rejected_by_vad': 0,  # Tiếng ồn không được VAD chấp nhận là giọng nói
+            'too_short': 0,  # Câu ngắn hơn MIN_AUDIO_LENGTH
+            'no_wake_word': 0,  # Bị wake word spotter loại, không gọi ASR
+            'sent_to_asr': 0,
+            'dispatched_early': 0,  # Lệnh chốt từ partial khi streaming, trước khi hết im lặng
+            'short_endpoints': 0,  # Câu chốt với COMMAND_SILENCE_THRESHOLD vì đã là lệnh hoàn chỉnh
+            'locked_out_packets': 0,  # Gói bị bỏ ngay đầu vào vì đang lock user khác
+            'asr_bytes': 0,  # Audio thật sự gửi nhận dạng (sau khi cắt im lặng)
+            'trimmed_bytes': 0,  # Im lặng đầu/cuối câu đã cắt bỏ
+        }
+        self.user_stats = {}  # user_id -> bộ đếm câu của từng user (USER_STAT_KEYS)
+        
+    keeps_concealed = False  # Bỏ frame PCM do decoder tự che
+
     def wants_opus(self):
         return False  # Request PCM data
 
-    async def check_silence(self):
-        while True:
-            await asyncio.sleep(0.2)  # Tăng từ 0.1 lên 0.2 để giảm tải CPU
-            try:
-                current_time = time.time()
-                users_to_process = []
+    def _acquire_buffer(self):
+        """Take a buffer from the pool, allocating one if the pool is empty."""
+        if self.buffer_pool:
+            return self.buffer_pool.pop()
+        stats = self.memory_stats
+        stats['allocated_bytes'] += self.buffer_capacity
+        stats['peak_allocated_bytes'] = max(stats['peak_allocated_bytes'], stats['allocated_bytes'])
+        return UtteranceBuffer(self.buffer_capacity)
+
+    def _release_buffer(self, buffer):
+        """Return a buffer to the pool, or free it if the pool is full."""
+        buffer.reset()
+        if len(self.buffer_pool) < BUFFER_POOL_SIZE:
+            self.buffer_pool.append(buffer)
+        else:
+            self.memory_stats['allocated_bytes'] -= buffer.capacity
+
+    def get_memory_stats(self):
+        """Snapshot of this sink's buffer memory counters."""
+        utterances = list(self.utterances)  # Có thể gọi từ thread nhận voice (debug)
+        stats = dict(self.memory_stats)
+        stats['buffered_bytes'] = sum(u.queued_bytes for u in utterances)
+        stats['active_buffers'] = sum(1 for u in utterances if u.buffer is not None)
+        stats['pooled_buffers'] = len(self.buffer_pool)
+        return stats
+
+    def get_vad_stats(self):
+        """Snapshot of utterances rejected by VAD / wake word spotter versus sent to ASR."""
+        return dict(self.vad_stats)
+
+    def _trim_range(self, pcm_data, user):
+        """Byte range of the utterance left after cutting leading/trailing non-speech."""
+        state = self.speakers.get(user)
+        floor = state.vad.noise_floor if state is not None else None
+        threshold = floor.threshold if floor is not None else RMS_THRESHOLD
+        frame_samples = ASR_SAMPLE_RATE * VAD_FRAME_MS // 1000
+        pad_frames = TRIM_PAD_MS // VAD_FRAME_MS
+        start, end = trim_bounds(from_bytes(pcm_data), frame_samples, threshold, pad_frames)
+        return start * 2, end * 2
+
+    def _count_user(self, user, key):
+        """Bump one of the user's utterance counters (receive thread or event loop)."""
+        user_id = getattr(user, 'id', user)
+        stats = self.user_stats.get(user_id)
+        if stats is None:
+            stats = self.user_stats.setdefault(user_id, dict.fromkeys(USER_STAT_KEYS, 0))
+        stats[key] += 1
+
+    def get_user_stats(self):
+        """Per-user utterances produced, discarded (by reason) and sent to ASR, with the current noise floor."""
+        floors = {}
+        for user, state in list(self.speakers.items()):
+            if state.vad.noise_floor is not None:
+                floors[getattr(user, 'id', user)] = state.vad.noise_floor
+        result = {}
+        for user_id, counters in list(self.user_stats.items()):
+            stats = dict(counters)
+            stats['discarded'] = sum(stats[key] for key in USER_DISCARD_KEYS)
+            frames = stats['frames']
+            stats['concealed_rate'] = round(stats['concealed_frames'] / frames, 4) if frames else 0.0
+            stats['corrupted_rate'] = round(stats['corrupted_frames'] / frames, 4) if frames else 0.0
+            floor = floors.get(user_id)
+            if floor is not None:
+                stats['noise_floor'] = round(floor.level, 1)
+                stats['rms_threshold'] = round(floor.threshold, 1)
+            result[user_id] = stats
+        return result
+
+    def _spawn(self, coro):
+        """Start a background task owned by this sink; cleanup() cancels it."""
+        if self.closed:
+            coro.close()
+            return None
+        task = self.bot.loop.create_task(coro)
+        self.tasks.add(task)
+        _sink_task_stats['live'] += 1
+        _sink_task_stats['started'] += 1
+        task.add_done_callback(self._on_task_done)
+        return task
+
+    def _on_task_done(self, task):
+        self.tasks.discard(task)
+        _sink_task_stats['live'] -= 1
+        if task.cancelled():
+            _sink_task_stats['cancelled'] += 1
+
+    def _drain(self, utterance):
+        """Move frames queued by the receive thread into the utterance's buffer."""
+        if utterance.buffer is None:
+            utterance.buffer = self._acquire_buffer()
+        frames = utterance.frames
+        while frames:
+            utterance.buffer.write(frames.popleft())
+        return utterance.buffer
+
+    def _discard_utterance(self, utterance):
+        """Drop an utterance without recognizing it and recycle its buffer."""
+        utterance.ended = True  # Thread nhận voice sẽ mở câu mới
+        utterance.done = True
+        utterance.frames.clear()
+        self.utterances.discard(utterance)
+        if utterance.stream is not None:
+            utterance.stream.closed = True
+        if utterance.buffer is not None:
+            self._release_buffer(utterance.buffer)
+            utterance.buffer = None
+
+    def _discard_all(self):
+        for utterance in list(self.utterances):
+            self._discard_utterance(utterance)
+
+    def _can_probe(self, utterance):
+        """Whether the current pause in this utterance is worth checking for a complete command."""
+        return (self.command_spotter.enabled and utterance.stream is None
+                and utterance.probe_time != utterance.last_speak_time
+                and utterance.silence_threshold > self.session.command_silence_threshold
+                and utterance.queued_bytes <= PCM_BYTES_PER_SECOND * COMMAND_MAX_LENGTH)
+
+    def _endpoint_deadline(self, utterance):
+        """Next time the endpoint timer has something to do for this utterance."""
+        if self._can_probe(utterance):
+            return utterance.last_speak_time + self.session.command_silence_threshold
+        return utterance.last_speak_time + utterance.silence_threshold
+
+    def _arm_endpoint(self, user, utterance):
+        """Arm the endpoint timer for the utterance's next pause check or silence deadline."""
+        if self.closed or utterance.done:
+            return
+        self.utterances.add(utterance)
+        self._arm_timer(user, utterance, self._endpoint_deadline(utterance))
+
+    def _arm_timer(self, user, utterance, deadline):
+        """(Re)arm the utterance's endpoint timer; any earlier timer for it becomes stale."""
+        utterance.timer += 1
+        self.scheduler.arm(deadline, partial(self._on_endpoint, user, utterance, utterance.timer))
+
+    def _on_endpoint(self, user, utterance, timer):
+        """Timer callback: hand the utterance to recognition once its speaker went silent."""
+        if self.closed or utterance.done or timer != utterance.timer:
+            return  # Timer cũ (đã arm timer mới) -> mỗi câu chỉ một chuỗi timer
+        current_time = time.monotonic()
+        if (not utterance.ended and self._can_probe(utterance)
+                and current_time >= utterance.last_speak_time + self.session.command_silence_threshold):
+            # Ngừng ngắn: kiểm tra câu đã là lệnh hoàn chỉnh chưa, trong lúc vẫn chờ im lặng dài
+            utterance.probe_time = utterance.last_speak_time
+            self._spawn(self._probe_command(user, utterance))
+        deadline = self._endpoint_deadline(utterance)
+        
+        if deadline > current_time and not utterance.ended:
+            # User nói tiếp sau khi arm -> dời deadline
+            self._arm_timer(user, utterance, deadline)
+            return
+        if not self.session.is_allowed_user(user.id if hasattr(user, 'id') else user):
+            # Clear buffer of non-priority user during lock
+            self._count_user(user, 'locked_out')
+            self._discard_utterance(utterance)
+            return
+        if user in self.pending_users:
+            # process_audio() sẽ arm lại khi xử lý xong
+            self.deferred.setdefault(user, []).append(utterance)
+            return
+        
+        # Rate limit: tối thiểu 2 giây giữa các lần xử lý
+        last_process = self.last_process_time.get(user, 0)
+        if current_time - last_process <= 2.0:
+            self._arm_timer(user, utterance, last_process + 2.0)
+            return
+        
+        utterance.ended = True
+        utterance.done = True
+        self.utterances.discard(utterance)
+        self.pending_users.add(user)
+        self.last_process_time[user] = current_time
+        
+        # Chỉ log nếu DEBUG_MODE bật
+        if DEBUG_MODE:
+            print(f"[Voice] Processing audio from user (silence timeout)")
+        self._spawn(self._process_utterance(user, utterance))
+
+    async def _probe_command(self, user, utterance):
+        """Endpoint right away if the audio so far is a complete control command ("luna skip")."""
+        if utterance.done:
+            return  # Bị bỏ (lock-out, cleanup) trước khi task chạy -> không lấy buffer
+        speak_time = utterance.probe_time
+        pcm = bytes(self._drain(utterance).view())
+        try:
+            text = await self.command_spotter.transcribe(pcm, ASR_SAMPLE_RATE, self.guild_id)
+        except ASRJobDropped:
+            return  # Pool quá tải -> chốt theo im lặng như thường
+        if utterance.done or utterance.last_speak_time != speak_time:
+            return  # Đã chốt, hoặc user nói tiếp -> không phải lệnh ngắn
+        if not text or not self.grammar.is_control(text):
+            return
+        self._shorten_endpoint(user, utterance)
+
+    def _shorten_endpoint(self, user, utterance):
+        """The utterance is a complete command: endpoint after the short per-guild pause."""
+        if utterance.silence_threshold == self.session.command_silence_threshold:
+            return
+        utterance.silence_threshold = self.session.command_silence_threshold
+        self.vad_stats['short_endpoints'] += 1
+        self._arm_timer(user, utterance, self._endpoint_deadline(utterance))
+
+    async def _process_utterance(self, user, utterance):
+        """Recognize an utterance taken off the endpoint timer."""
+        # Chuyển nguyên buffer sang nhận dạng, không copy
+        audio_buffer = self._drain(utterance)
+        utterance.buffer = None
+        await self.process_audio(audio_buffer, user, utterance.stream)
+
+    def _force_endpoint(self, user, utterance):
+        """Endpoint an utterance right away because it hit MAX_UTTERANCE_LENGTH."""
+        self.memory_stats['capped_utterances'] += 1
+        self._arm_timer(user, utterance, time.monotonic())
+
+    def _on_stream_chunk(self, user, utterance):
+        """Another STREAM_CHUNK_BYTES were queued: feed the streaming recognizers."""
+        if self.closed or utterance.done:
+            return
+        if utterance.stream is None:
+            utterance.stream = UserStream(self._drain(utterance))
+        if not utterance.stream.scheduled:
+            utterance.stream.scheduled = True
+            self._spawn(self._feed_stream(user, utterance))
+
+    async def _feed_stream(self, user, utterance):
+        """Feed new audio to the user's streaming recognizers and dispatch a stable command early."""
+        backend = self.language_strategy.backend
+        stream = utterance.stream
+        user_id = user.id if hasattr(user, 'id') else user
+        async with stream.lock:
+            if stream.languages is None:
+                stream.languages = self.language_strategy.languages_for(user_id)
+            while True:
+                if stream.closed:
+                    return
+                if not utterance.done:
+                    self._drain(utterance)
+                chunk = bytes(stream.buffer.view()[stream.fed:])
+                if not chunk:
+                    stream.scheduled = False
+                    return
+                try:
+                    partials = await get_asr_pool().run(self.guild_id, lambda: stream.feed(backend, chunk))
+                except Exception as e:
+                    # Chunk chưa tới recognizer (lỗi / job bị bỏ): giữ fed, lần feed sau hoặc finish gửi lại
+                    if DEBUG_MODE:
+                        print(f"[Voice] Stream feed error: {e}")
+                    stream.scheduled = False
+                    return
+                stream.fed += len(chunk)
                 
-                with self.lock:
-                    for user, buffer in list(self.buffers.items()):
-                        if len(buffer) > 0:
-                            silence_duration = current_time - self.last_speak_time.get(user, 0)
-                            
-                            # Check if this user is allowed to speak (priority system)
-                            if not is_allowed_user(user.id if hasattr(user, 'id') else user):
-                                # Clear buffer of non-priority user during lock
-                                self.buffers[user] = bytearray()
-                                continue
-                            
-                            # Chỉ xử lý nếu đủ im lặng và user chưa đang được xử lý
-                            if silence_duration > SILENCE_THRESHOLD and user not in self.pending_users:
-                                # Rate limit: không xử lý user quá thường xuyên
-                                last_process = self.last_process_time.get(user, 0)
-                                if current_time - last_process > 2.0:  # Tối thiểu 2 giây giữa các lần xử lý
-                                    users_to_process.append(user)
-                    
-                    for user in users_to_process:
-                        if len(self.buffers[user]) > 0:
-                            audio_data = bytes(self.buffers[user])
-                            self.buffers[user] = bytearray()
-                            self.pending_users.add(user)
-                            self.last_process_time[user] = current_time
-                            
-                            # Chỉ log nếu DEBUG_MODE bật
-                            if DEBUG_MODE:
-                                print(f"[Voice] Processing audio from user (silence timeout)")
-                            
-                            self.bot.loop.create_task(self.process_audio(audio_data, user))
-                            
-            except Exception as e:
-                if DEBUG_MODE:
-                    print(f"[Voice] Silence checker error: {e}")
+                if any(text and self.grammar.is_control(text) for text in partials.values()):
+                    self._shorten_endpoint(user, utterance)
+                else:
+                    utterance.silence_threshold = self.session.silence_threshold  # Nói tiếp (vd. tên bài)
+                command = stream.stable_command(partials)
+                if command is None:
+                    continue
+                # Partial đã là lệnh hoàn chỉnh -> chốt luôn, không chờ hết im lặng
+                if utterance.done or stream.closed:
+                    return
+                self._discard_utterance(utterance)
+                self.last_process_time[user] = time.monotonic()
+                self.vad_stats['dispatched_early'] += 1
+                self.language_strategy.pick({lang: command for lang in stream.languages}, user_id)
+                await self._accept_text(command)
+                return
+
+    def _new_vad(self):
+        return VoiceActivityDetector()
+
+    def _concealment(self, data):
+        """USER_FRAME_KEYS counter for a frame voice_recv made up (lost/corrupted packet), else None."""
+        pcm = data.pcm
+        if isinstance(pcm, CorruptedPCM):
+            return 'corrupted_frames'
+        if isinstance(pcm, ConcealedPCM):
+            return 'concealed_frames'
+        return None
+
+    def _frame_size(self, frame):
+        """Bytes of 16 kHz PCM a queued frame stands for."""
+        return len(frame)
+
+    def _analyze(self, state, data):
+        """Turn received audio into (frame, speech, started, rejected), or None if nothing is ready.
+
+        Runs on the voice receive thread. Packets are processed
+        INGEST_BATCH_PACKETS at a time so the NumPy calls run once per batch.
+        """
+        now = time.monotonic()
+        if state.raw and now - state.raw_time > INGEST_BATCH_GAP:
+            state.raw.clear()  # User đã ngừng gửi: phần gom dở chỉ là đuôi im lặng
+        state.raw.append(data.pcm)
+        state.raw_time = now
+        if len(state.raw) < INGEST_BATCH_PACKETS:
+            return None
+        raw = b''.join(state.raw)
+        state.raw.clear()
+
+        try:
+            # Downmix + giảm mẫu ngay khi nhận, buffer nhỏ hơn 6 lần
+            samples = state.resampler.process(to_mono(from_bytes(raw)))
+        except Exception as e:
+            return None  # Bỏ qua packet lỗi thay vì log
+
+        # VAD tự bỏ qua frame dưới RMS_THRESHOLD (tiếng ồn nhỏ)
+        pcm = samples.tobytes()
+        return (pcm,) + state.vad.process(pcm, samples)
 
     def write(self, user, data):
         if user is None:
@@ -144,128 +987,252 @@ class DiscordSink(voice_recv.AudioSink):
             current_time = time.time()
             if current_time - self.last_debug_time > DEBUG_INTERVAL:
                 print(f"[Voice] Received {self.write_counter} audio packets in last {DEBUG_INTERVAL}s")
+                print(f"[Voice] Buffer memory: {self.get_memory_stats()}")
+                print(f"[Voice] VAD: {self.get_vad_stats()}")
+                print(f"[Voice] Users: {self.get_user_stats()}")
+                print(f"[Voice] Opus: {get_opus_stats()}")
+                print(f"[Voice] ASR: {self.language_strategy.get_stats()}")
+                print(f"[Voice] ASR pool: {get_asr_pool().get_stats()}")
+                print(f"[Voice] ASR HTTP: {get_speech_client().get_stats()}")
+                print(f"[Voice] Sink tasks: {get_sink_task_stats()}")
                 self.write_counter = 0
                 self.last_debug_time = current_time
 
-        with self.lock:
-            if user not in self.buffers:
-                self.buffers[user] = bytearray()
-                self.last_speak_time[user] = time.time()
+        # Đang lock user khác -> bỏ gói ngay, trước khi phân tích audio
+        active_user_id = self.session.active_user_id
+        if active_user_id is not None and active_user_id != getattr(user, 'id', user):
+            self.vad_stats['locked_out_packets'] += 1
+            return
 
-            try:
-                rms = audioop.rms(data.pcm, 2)
-            except Exception as e:
-                return  # Bỏ qua lỗi RMS thay vì log
+        # Frame do decoder tự che (mất/hỏng gói) không phải giọng nói thật:
+        # đếm theo user rồi bỏ, không để kéo dài câu hay vào payload ASR
+        self._count_user(user, 'frames')
+        concealment = self._concealment(data)
+        if concealment is not None:
+            self._count_user(user, concealment)
+            if not self.keeps_concealed:
+                return
 
-            # Tăng ngưỡng RMS để bỏ qua tiếng ồn nhỏ
-            if rms > RMS_THRESHOLD:
-                self.buffers[user].extend(data.pcm)
-                self.last_speak_time[user] = time.time()
+        # Không lock: state của user chỉ thread này đụng tới
+        state = self.speakers.get(user)
+        if state is None:
+            state = self.speakers[user] = SpeakerState(self._new_vad())
+
+        analyzed = self._analyze(state, data)
+        if analyzed is None:
+            return
+        frame, speech, started, rejected = analyzed
+        if rejected:
+            self.vad_stats['rejected_by_vad'] += 1
+            self._count_user(user, 'rejected_by_vad')
+
+        now = time.monotonic()
+        utterance = state.utterance
+        loop = self.bot.loop
+        if speech:
+            if utterance is not None and utterance.capped and not utterance.done:
+                # Câu đã đầy, bỏ audio cho tới khi event loop lấy câu đi
+                self.memory_stats['dropped_bytes'] += self._frame_size(frame)
+                return
+            new_utterance = utterance is None or utterance.ended
+            if new_utterance:
+                utterance = state.utterance = PendingUtterance(now, self.session.silence_threshold)
+                self._count_user(user, 'utterances')
+            # Câu mới: thêm cả pre-roll để không mất âm tiết đầu
+            packets = state.vad.take_preroll() if started and new_utterance else (frame,)
+            for packet in packets:
+                size = self._frame_size(packet)
+                if utterance.capped:
+                    self.memory_stats['dropped_bytes'] += size
+                elif not utterance.push(packet, size, self.buffer_capacity):
+                    # Quá MAX_UTTERANCE_LENGTH: chốt câu luôn, không chờ im lặng
+                    utterance.capped = utterance.ended = True
+                    self.memory_stats['dropped_bytes'] += size
+                    loop.call_soon_threadsafe(self._force_endpoint, user, utterance)
+            utterance.last_speak_time = now
+            if new_utterance:
+                # write() chạy trên thread nhận voice, timer phải arm trên event loop
+                loop.call_soon_threadsafe(self._arm_endpoint, user, utterance)
+            
+            # Streaming: mỗi STREAM_CHUNK_BYTES audio mới thì báo event loop
+            if self.streaming and utterance.queued_bytes - utterance.signalled_bytes >= STREAM_CHUNK_BYTES:
+                utterance.signalled_bytes = utterance.queued_bytes
+                loop.call_soon_threadsafe(self._on_stream_chunk, user, utterance)
+        elif utterance is not None and not utterance.ended:
+            # Vẫn thêm audio nếu đang trong quá trình nói (để không cắt giữa chừng)
+            if now - utterance.last_speak_time < utterance.silence_threshold:
+                utterance.push(frame, self._frame_size(frame), self.buffer_capacity)
             else:
-                silence_duration = time.time() - self.last_speak_time[user]
-                
-                # Vẫn thêm audio nếu đang trong quá trình nói (để không cắt giữa chừng)
-                if user in self.buffers and len(self.buffers[user]) > 0 and silence_duration < SILENCE_THRESHOLD:
-                    self.buffers[user].extend(data.pcm)
+                utterance.ended = True  # Timer trên event loop sẽ chốt câu
+
+    async def _finish_stream(self, stream, user_id):
+        """Feed the rest of the utterance to the streaming recognizers and pick the final text."""
+        backend = self.language_strategy.backend
+        async with stream.lock:
+            stream.closed = True
+            remaining = bytes(stream.buffer.view()[stream.fed:])
+            if stream.languages is None:
+                stream.languages = self.language_strategy.languages_for(user_id)
+            results = await get_asr_pool().run(self.guild_id, lambda: stream.finish(backend, remaining))
+        return self.language_strategy.pick(results, user_id)
 
-    async def process_audio(self, pcm_data, user=None):
+    async def process_audio(self, audio_buffer, user=None, stream=None):
         """Xử lý audio và nhận dạng giọng nói"""
+        pcm_data = audio_buffer.view()
         try:
             # Kiểm tra độ dài tối thiểu
-            min_bytes = int(48000 * 2 * MIN_AUDIO_LENGTH)
+            min_bytes = int(PCM_BYTES_PER_SECOND * MIN_AUDIO_LENGTH)
             if len(pcm_data) < min_bytes:
+                self.vad_stats['too_short'] += 1
+                self._count_user(user, 'too_short')
                 return  # Quá ngắn, bỏ qua
 
-            try:
-                mono_data = audioop.tomono(pcm_data, 2, 0.5, 0.5)
-            except Exception as e:
+            user_id = user.id if hasattr(user, 'id') else user
+            if stream is not None:
+                # Streaming: recognizer đã nghe gần hết câu, chỉ cần chốt
+                self.vad_stats['sent_to_asr'] += 1
+                self._count_user(user, 'sent_to_asr')
+                final_text = await self._finish_stream(stream, user_id)
+                await self._accept_text(final_text)
                 return
 
-            audio = sr.AudioData(mono_data, 48000, 2)
+            # Cắt im lặng đầu/cuối (tới 1.5s đuôi) trước khi encode và gửi đi
+            start, end = self._trim_range(pcm_data, user)
+            self.vad_stats['trimmed_bytes'] += len(pcm_data) - (end - start)
+            if start == end:
+                self.vad_stats['too_short'] += 1
+                self._count_user(user, 'too_short')
+                return  # Toàn im lặng / tiếng ồn nền
 
-            loop = asyncio.get_event_loop()
-            
-            async def try_recognize(lang):
-                try:
-                    result = await loop.run_in_executor(
-                        None, 
-                        lambda: self.recognizer.recognize_google(audio, language=lang)
-                    )
-                    return result.strip().lower() if result else None
-                except sr.UnknownValueError:
-                    return None
-                except Exception:
-                    return None
-            
-            # Chạy cả 2 ngôn ngữ song song
-            vi_task = asyncio.create_task(try_recognize("vi-VN"))
-            en_task = asyncio.create_task(try_recognize("en-US"))
-            
-            vi_result, en_result = await asyncio.gather(vi_task, en_task)
-            
-            # Xác định kết quả
-            final_text = None
-            
-            if vi_result and en_result:
-                # Ưu tiên tiếng Việt cho các lệnh điều khiển
-                vi_commands = ["luna", "chuyển bài", "ngắt kết nối", "bài hiện tại", "ngắt", "kết nối"]
-                is_vi_command = any(cmd in vi_result for cmd in vi_commands)
-                
-                if is_vi_command:
-                    final_text = vi_result
-                else:
-                    # Cho bài hát, ưu tiên tiếng Anh
-                    final_text = en_result if len(en_result) >= len(vi_result) * 0.7 else vi_result
-                    
-            elif vi_result:
-                final_text = vi_result
-            elif en_result:
-                final_text = en_result
+            # Buffer đã là 16kHz mono (_drain đã copy frame vào buffer); copy đoạn đã cắt
+            # thành bytes vì buffer quay lại pool trong khi job ASR trong thread có thể còn chạy
+            pcm = bytes(pcm_data[start:end])
+
+            # Không bắt đầu bằng wake word -> bỏ luôn, không tốn request mạng
+            if not await self.wake_spotter.detect(pcm, ASR_SAMPLE_RATE, self.guild_id):
+                self.vad_stats['no_wake_word'] += 1
+                self._count_user(user, 'no_wake_word')
+                if DEBUG_MODE:
+                    print(f"[Voice] ❌ Ignored (no wake word, local spotter)")
+                return
+
+            self.vad_stats['sent_to_asr'] += 1
+            self.vad_stats['asr_bytes'] += len(pcm)
+            self._count_user(user, 'sent_to_asr')
             
-            # Chỉ đưa vào queue nếu có kết quả và chứa wake word hoặc là lệnh quan trọng
-            if final_text:
-                # 🔊 DEBUG: Print everything bot hears
-                print(f"[Voice] 👂 Heard: \"{final_text}\"")
-                
-                # ALL commands require Luna wake word to prevent accidental triggers
-                important_commands = [
-                    "luna skip", "luna chuyển bài", "luna ngắt kết nối", 
-                    "luna disconnect", "luna thoát", "luna cút", "luna bye",
-                    "luna bỏ qua", "luna qua bài", "luna bài tiếp", "luna next",
-                    "luna bài hiện tại", "luna đang phát", "luna bài gì", "luna now playing", "luna bài này là gì"
-                ]
-                
-                # Kiểm tra xem có phải là nội dung quan trọng không
-                contains_wake_word = any(wake in final_text for wake in WAKE_WORDS)
-                contains_command = any(cmd in final_text for cmd in important_commands)
-                
-                if contains_wake_word or contains_command:
-                    current_time = time.time()
-                    
-                    # Duplicate check - không gửi cùng text trong DUPLICATE_COOLDOWN giây
-                    if (final_text == self.last_recognized_text and 
-                        current_time - self.last_recognized_time < self.DUPLICATE_COOLDOWN):
-                        print(f"[Voice] ⏳ Duplicate skipped: {final_text[:30]}...")
-                    else:
-                        print(f"[Voice] ✅ Command accepted: {final_text}")
-                        self.last_recognized_text = final_text
-                        self.last_recognized_time = current_time
-                        await text_queue.put(final_text)
-                else:
-                    # Không phải lệnh quan trọng -> bỏ qua
-                    print(f"[Voice] ❌ Ignored (no wake word)")
+            # Nhận dạng vi/en, chiến lược tự chọn kết quả và hủy request thừa
+            final_text = await self.language_strategy.recognize(pcm, ASR_SAMPLE_RATE, user_id, self.guild_id)
+            await self._accept_text(final_text)
                         
         except Exception as e:
             if DEBUG_MODE:
                 print(f"[Voice] Error: {e}")
         finally:
-            # Xóa user khỏi pending sau khi xử lý xong
+            # Trả buffer về pool và xóa user khỏi pending sau khi xử lý xong
+            pcm_data.release()
+            if stream is not None:
+                stream.closed = True
+            self._release_buffer(audio_buffer)
             if user:
-                with self.lock:
-                    self.pending_users.discard(user)
+                self.pending_users.discard(user)
+                for utterance in self.deferred.pop(user, ()):
+                    self._arm_endpoint(user, utterance)
+
+    async def _accept_text(self, final_text):
+        """Queue recognized text for the guild if it holds a wake word or command."""
+        # Chỉ đưa vào queue nếu có kết quả và chứa wake word hoặc là lệnh quan trọng
+        if not final_text:
+            return
+        # 🔊 DEBUG: Print everything bot hears
+        print(f"[Voice] 👂 Heard: \"{final_text}\"")
+        
+        # Có wake word hoặc lệnh (mọi lệnh đều bắt đầu bằng "luna") -> đưa cho bot
+        if self.grammar.match(final_text) is not None:
+            await self.session.put_phrase(final_text)
+        else:
+            # Không phải lệnh quan trọng -> bỏ qua
+            print(f"[Voice] ❌ Ignored (no wake word)")
+
+    def _shutdown(self):
+        """Drop pending audio and cancel this sink's background tasks (event loop)."""
+        self._discard_all()
+        for task in list(self.tasks):
+            task.cancel()
 
     def cleanup(self):
-        pass
+        self.closed = True
+        # cleanup() có thể chạy trên thread của voice_recv, dọn buffer + task trên event loop
+        try:
+            self.bot.loop.call_soon_threadsafe(self._shutdown)
+        except RuntimeError:
+            pass  # Event loop đã đóng
+
+class OpusDiscordSink(DiscordSink):
+    """DiscordSink that receives Opus packets and decodes only what gets recognized.
+
+    voice_recv skips decoding entirely, speech is found from packet sizes
+    (OpusActivityDetector), and an utterance is decoded on the Opus worker
+    only after it passed the endpoint, priority and length checks.
+    Streaming recognition needs PCM while the user speaks, so it is off here.
+    """
+
+    def __init__(self, bot, session):
+        super().__init__(bot, session)
+        if self.streaming:
+            print("⚠️ Streaming recognition needs CAPTURE_MODE=pcm, using batch mode")
+            self.streaming = False
+        self.frame_pcm_bytes = PCM_BYTES_PER_SECOND * OPUS_FRAME_MS // 1000
+
+    keeps_concealed = True  # Gói mất vẫn vào hàng đợi (None), decoder che khi giải mã câu
+
+    def wants_opus(self):
+        return True  # Nhận gói Opus, không giải mã trên thread nhận voice
+
+    def _concealment(self, data):
+        return None if data.opus else 'concealed_frames'
+
+    def _new_vad(self):
+        return OpusActivityDetector()
+
+    def _frame_size(self, frame):
+        return self.frame_pcm_bytes
+
+    def _can_probe(self, utterance):
+        return False  # Hàng đợi là gói Opus, spotter cần PCM -> chỉ chốt theo im lặng
+
+    def _analyze(self, state, data):
+        packet = data.opus or None  # Gói mất (FakePacket) -> None, decoder tự che
+        return (packet,) + state.vad.process(packet)
+
+    async def _process_utterance(self, user, utterance):
+        if utterance.buffer is not None:
+            self._release_buffer(utterance.buffer)
+            utterance.buffer = None
+        packets = []
+        while utterance.frames:
+            packets.append(utterance.frames.popleft())
+        audio_buffer = self._acquire_buffer()
+        # Câu quá ngắn thì không cần giải mã, process_audio sẽ bỏ
+        if utterance.queued_bytes >= PCM_BYTES_PER_SECOND * MIN_AUDIO_LENGTH:
+            try:
+                pcm = await get_opus_decoder().decode(packets, ASR_SAMPLE_RATE)
+                audio_buffer.write(pcm[:audio_buffer.capacity])
+            except Exception as e:
+                if DEBUG_MODE:
+                    print(f"[Voice] Opus decode error: {e}")
+        await self.process_audio(audio_buffer, user)
+
+SINK_CLASSES = {
+    'pcm': DiscordSink,
+    'opus': OpusDiscordSink,
+}
+
+def stop_playing(voice_client):
+    """Stop the current track but keep listening (VoiceRecvClient.stop() also stops the listener)."""
+    if hasattr(voice_client, 'stop_playing'):
+        voice_client.stop_playing()
+    else:
+        voice_client.stop()
 
 def setup_sink(voice_client, bot, force_restart=False):
     """Setup voice sink for listening. 
@@ -273,7 +1240,12 @@ def setup_sink(voice_client, bot, force_restart=False):
     Args:
         voice_client: Discord voice client
         bot: Discord bot instance
-        force_restart: If True, stop current listener and start new one (use after skip)
+        force_restart: If True, stop current listener and start new one (only if it is stuck)
+    
+    The sink belongs to the voice session of the voice client's guild and is
+    kept across plays and skips: if the client is already listening, the
+    current sink is returned untouched. Use stop_playing() to skip a track,
+    voice_client.stop() would stop the listener as well.
     """
     try:
         # Check if already listening
@@ -281,17 +1253,25 @@ def setup_sink(voice_client, bot, force_restart=False):
         
         if is_listening:
             if not force_restart:
-                # Already listening and no force restart, skip
-                return None
+                # Đang nghe: giữ sink, không mất câu đang nói dở
+                return get_session(voice_client.guild.id).sink
             else:
                 # Force restart: stop current listener first
                 try:
-                    voice_client.stop_listening()
+                    voice_client.stop_listening()  # voice_recv gọi cleanup() của sink cũ
                     print("[Voice] 🔄 Stopped old listener for restart")
                 except Exception as e:
                     print(f"[Voice] Warning stopping listener: {e}")
         
-        sink = DiscordSink(bot)
+        session = get_session(voice_client.guild.id)
+        if session.sink is not None:
+            session.sink.cleanup()
+        sink_cls = SINK_CLASSES.get(CAPTURE_MODE)
+        if sink_cls is None:
+            print(f"⚠️ Unknown CAPTURE_MODE '{CAPTURE_MODE}', using pcm")
+            sink_cls = DiscordSink
+        sink = sink_cls(bot, session)
+        session.sink = sink
         voice_client.listen(sink)
         print("[Voice] 🎤 Voice listener started")
         return sink
@@ -299,5 +1279,3 @@ def setup_sink(voice_client, bot, force_restart=False):
         print(f"[Voice] setup_sink error: {e}")
         return None
 
-async def get_next_phrase():
-    return await text_queue.get()
@@ -0,0 +1,93 @@
+"""
+Local wake-word spotter that runs before any network ASR call.
+
+Uses a Vosk recognizer restricted to a tiny grammar (the wake words plus
+"[unk]") on the first WAKE_SPOT_WINDOW seconds of an utterance, which is
+cheap enough to run on every utterance on CPU. Utterances that do not start
+with "Luna" are dropped before they cost two cloud requests. The same
+spotter with the control commands as grammar tells the endpointer that an
+utterance is already a complete command.
+Nếu không có vosk hoặc model, spotter tự tắt và cho mọi câu đi qua.
+"""
+
+import json
+import os
+from dotenv import load_dotenv
+from asr_backends import VOSK_AVAILABLE, VOSK_MODEL_PATHS, load_vosk_model, vosk
+from asr_pool import ASRJobDropped, get_asr_pool
+
+load_dotenv()
+
+# ============================================
+# CONFIGURATION
+# ============================================
+WAKE_SPOTTER_ENABLED = os.getenv('WAKE_SPOTTER', '1') != '0'
+WAKE_SPOT_WINDOW = 1.0  # Chỉ nghe giây đầu tiên của câu nói (giây)
+WAKE_WORD_MODEL = os.getenv('WAKE_WORD_MODEL') or VOSK_MODEL_PATHS.get('vi-VN') or VOSK_MODEL_PATHS.get('en-US')
+
+
+class WakeWordSpotter:
+    """Keyword spotter for the wake words (or other phrases) at the start of an utterance."""
+
+    def __init__(self, wake_words, model_path=WAKE_WORD_MODEL, window=WAKE_SPOT_WINDOW):
+        self.wake_words = list(wake_words)
+        self.window = window
+        self.grammar = json.dumps(self.wake_words + ["[unk]"], ensure_ascii=False)
+        self.model = None
+        self.stats = {'spotted': 0, 'rejected': 0, 'dropped': 0}
+
+        if not WAKE_SPOTTER_ENABLED:
+            return
+        if not VOSK_AVAILABLE or not model_path:
+            print("ℹ️ Wake word spotter disabled - needs vosk and WAKE_WORD_MODEL (or VOSK_MODEL_VI) in .env")
+            return
+        try:
+            self.model = load_vosk_model(model_path)
+            print(f"✅ Wake word spotter ready ({len(self.wake_words)} keywords)")
+        except Exception as e:
+            print(f"⚠️ Wake word spotter disabled: {e}")
+
+    @property
+    def enabled(self):
+        return self.model is not None
+
+    def _spot_sync(self, pcm, sample_rate):
+        recognizer = vosk.KaldiRecognizer(self.model, sample_rate, self.grammar)
+        recognizer.AcceptWaveform(pcm)
+        return json.loads(recognizer.FinalResult()).get('text', '')
+
+    async def transcribe(self, pcm, sample_rate, guild_id=None):
+        """Grammar-restricted text of the first `window` seconds ("[unk]" for anything else).
+
+        None when disabled or on error. Raises ASRJobDropped when the ASR pool
+        sheds the job under backlog.
+        """
+        if not self.enabled:
+            return None
+        window = pcm[:int(sample_rate * self.window) * 2]
+        try:
+            return await get_asr_pool().run(
+                guild_id,
+                lambda: self._spot_sync(window, sample_rate)
+            )
+        except ASRJobDropped:
+            raise
+        except Exception:
+            return None
+
+    async def detect(self, pcm, sample_rate, guild_id=None):
+        """Whether the utterance starts with a wake word.
+
+        Always True when disabled; False when the ASR pool dropped the job.
+        """
+        try:
+            text = await self.transcribe(pcm, sample_rate, guild_id)
+        except ASRJobDropped:
+            # Pool đang quá tải -> bỏ câu nói, không để nó đi tiếp tới ASR mạng
+            self.stats['dropped'] += 1
+            return False
+        if text is None:
+            return True  # Tắt hoặc lỗi thì không chặn câu nói
+        spotted = any(wake in text for wake in self.wake_words)
+        self.stats['spotted' if spotted else 'rejected'] += 1
+        return spotted